@@ -13,76 +13,148 @@ import re
 
 #Local imports
 from ntrkmariadb import DBWrapper
+from suffixindex import SuffixIndex
 
 #Create logger
 logger = logging.getLogger(__name__)
 #logger.setLevel(logging.INFO)
 
+#Malware blocklists in order of priority
+MALWARE_BLOCKLISTS = (
+    'bl_notrack_malware',
+    'bl_hexxium',
+    'bl_cedia',
+    'bl_cedia_immortal',
+    'bl_malwaredomainlist',
+    'bl_malwaredomains',
+    'bl_swissransom',
+)
+
+#Regex patterns of domains to ignore, as they're secondary DNS lookups or CDN's
+IGNORE_PATTERNS = (
+    r'akadns\.net$',
+    r'amazonaws\.com$',
+    r'edgekey\.net$',
+    r'elasticbeanstalk\.com$',
+    r'\w{3}pixel\.[\w-]{1,63}$',                          #Prevent false positive where pixel is part of domain name e.g. retropixel
+)
+
+#Tracker and advertising patterns in order of priority: pattern, issue
+#Have to exclude tracker. (bittorent), security-tracker (Debian), and tracking-protection (Mozilla)
+TRACKER_PATTERNS = (
+    (r'^analytics\.', 'tracker'),                         #analytics as a subdomain
+    (r'^cl(c|ck|icks?|kstat)\.', 'tracker'),              #clc, clck, clicks?, clkstat as a subdomain
+    (r'^log(s|ger)?\.', 'tracker'),                       #log, logs, logger as a subdomain (exclude login.)
+    (r'^pxl?\.', 'tracker'),                              #px, pxl, as a subdomain
+    (r'pixel[^\.]{0,8}\.', 'tracker'),                    #pixel, followed by 0 to 8 non-dot chars anywhere
+    (r'^s?metrics\.', 'tracker'),                         #smetrics, metrics as a subdomain
+    (r'telemetry', 'tracker'),                            #telemetry anywhere
+    (r'trk[^\.]{0,3}\.', 'tracker'),                      #trk, followed by 0 to 3 non-dot chars anywhere
+    (r'^trace\.', 'tracker'),                             #trace as a subdomain
+    (r'track(ing|\-[a-z]{2,8})?\.', 'tracker'),           #track, tracking, track-eu as a subdomain / domain
+    (r'^visit\.', 'tracker'),                             #visit as a subdomain
+    (r'^v?stats?\.', 'tracker'),                          #vstat, stat, stats as a subdomain
+    (r'^ads\.', 'advert'),
+    (r'^adserver', 'advert'),
+    (r'^advert', 'advert'),
+)
+
+
+def compile_trackerpatterns(patterns):
+    """
+    Combine patterns into one regex, which reports the first pattern in order of priority matching a domain
+    Each pattern is a lookahead from the start of the domain followed by an empty group named p<n>
+    Unanchored patterns are searched for anywhere with a leading .*?
+    Matching is case insensitive, the same as MariaDB REGEXP
+
+    Parameters:
+        patterns (tuple): Tuples of pattern, issue
+    Returns:
+        Compiled regex, match.lastgroup is the name of the group for the matching pattern
+    """
+    alternatives = []
+
+    for i, (pattern, _) in enumerate(patterns):
+        if pattern.startswith('^'):
+            alternatives.append(f'(?=(?:{pattern[1:]}))(?P<p{i}>)')
+        else:
+            alternatives.append(f'(?=.*?(?:{pattern}))(?P<p{i}>)')
+
+    return re.compile('|'.join(alternatives), re.IGNORECASE)
+
+
+Regex_Ignore = re.compile('|'.join(f'(?:{pattern})' for pattern in IGNORE_PATTERNS))
+Regex_Trackers = compile_trackerpatterns(TRACKER_PATTERNS)
+
 class NoTrackAnalytics():
     def __init__(self):
         self.__domainsfound = set()                        #Prevent duplicates
         self.__blocklists = list()                         #Active blocklists
-        self.__whitelist = list()                          #Users whitelist
-
-        self.__ignorelist = {                              #Regex pattern of domains to ignore
-          'akadns\.net$',
-          'amazonaws\.com$',
-          'edgekey\.net$',
-          'elasticbeanstalk\.com$',
-          '\w{3}pixel\.[\w-]{1,63}$',                      #Prevent false positive where pixel is part of domain name e.g. retropixel
-        }
+        self.__whitelist = SuffixIndex()                   #Users whitelisted domains
+        self.__malware = SuffixIndex()                     #Domains of active malware blocklists: blocklist name
+        self.__updates = list()                            #dnslog rows to update at the end of a check
+        self.__inserts = list()                            #analytics records to add at the end of a check
 
         self.__dbwrapper = DBWrapper()                     #Declare MariaDB Wrapper
         self.__dbwrapper.analytics_createtable()           #Check analytics table exists
 
         #Load the black and whitelists from blocklist table
-        self.__blocklists = self.__dbwrapper.blocklist_getactive()
-        self.__whitelist = self.__dbwrapper.blocklist_getwhitelist()
+        self.get_blocklists()
 
 
-    def __searchmalware(self, bl):
+    def __load_whitelist(self):
+        """
+        Load users whitelisted domains into the whitelist index
         """
-        Search for results from a specific malware blocklist
-        Parse found results to __review_results
+        self.__whitelist = SuffixIndex()
 
-        Parameters:
-            bl (str): Blocklist name
+        for site in self.__dbwrapper.blocklist_getwhitelist():
+            self.__whitelist.add(site, site)
+
+
+    def __load_malware(self):
         """
+        Load domains of the active malware blocklists into the malware index
+        A domain in more than one blocklist is labelled with the first blocklist in MALWARE_BLOCKLISTS
+        """
+        activelists = [bl for bl in MALWARE_BLOCKLISTS if bl in self.__blocklists]
+        priority = {bl: i for i, bl in enumerate(activelists)}
         tabledata = []                                     #Results of MariaDB search
 
-        logger.info(f'Searching for domains from: {bl}')
-        tabledata = self.__dbwrapper.dnslog_searchmalware(bl)
+        self.__malware = SuffixIndex()
 
-        if len(tabledata) == 0:
-            logger.info('No results found :-)')
+        if len(activelists) == 0:
             return
 
-        self.__review_results(f'malware-{bl}', tabledata)  #Specify name of malware list
+        tabledata = self.__dbwrapper.blocklist_getdomains_sources(activelists)
+
+        for site, bl_source in sorted(tabledata, key=lambda row: priority[row[1]]):
+            if site not in self.__malware:
+                self.__malware.add(site, bl_source)
+
+        logger.info(f'Loaded {len(self.__malware)} domains from {len(activelists)} malware blocklists')
 
 
-    def __searchregex(self, pattern, listtype):
+    def __match_tracker(self, domain):
         """
-        Search for specified results pattern
-        Parse found results to __review_results
+        Find the first tracker pattern matching a domain
 
         Parameters:
-            pattern (str): Regex pattern to search
+            domain (str): Domain to check
+        Returns:
+            Position of pattern in TRACKER_PATTERNS, or None when nothing matched
         """
-        tabledata = []                                     #Results of MariaDB search
+        match = Regex_Trackers.match(domain)
 
-        logger.info(f'Searching for regular expression: {pattern}')
-        tabledata = self.__dbwrapper.dnslog_searchregex(pattern)
+        if match is None:
+            return None
 
-        if len(tabledata) == 0:
-            logger.info('No results found :-)')
-            return
-
-        self.__review_results(listtype, tabledata)
+        return int(match.lastgroup[1:])
 
 
     def __is_ignorelist(self, domain):
         """
-        Check if domain is in ignore list
+        Check if domain matches any of the IGNORE_PATTERNS
         Some domains should be ignored as they're secondary DNS lookups or CDN's
 
         Parameters:
@@ -91,19 +163,18 @@ class NoTrackAnalytics():
             True: Domain is in ignorelist
             False: Domain is not in ignorelist
         """
-        pattern = ''                                       #Regex pattern to check
+        match = Regex_Ignore.search(domain)
 
-        for pattern in self.__ignorelist:                  #Check everything in ignorelist
-            if re.search(pattern, domain) is not None:     #Something matched?
-                logger.info(f'{domain} matched pattern {pattern} in ignorelist')
-                return True
+        if match is not None:
+            logger.info(f'{domain} matched {match.group(0)} in ignorelist')
+            return True
 
         return False
 
 
     def __is_whitelist(self, domain):
         """
-        Check if domain is in whitelist
+        Check if domain or any of its parent domains is in whitelist
 
         Parameters:
             domain (str): Domain to check
@@ -111,16 +182,11 @@ class NoTrackAnalytics():
             True: Domain is in whitelist
             False: Domain is not in whitelist
         """
-        if len(self.__whitelist) == 0:                     #Check if whitelist is empty
-            return False                                   #No point in going any further with whitelist checks
+        site = self.__whitelist.find(domain)
 
-        pattern = ''                                       #Regex pattern to check
-
-        for pattern in self.__whitelist:                   #Treat whitelist results as a regex pattern
-            #"domain" could be a subdomain, so we check for a match from the end backwards
-            if re.match(pattern + '$', domain) is not None:
-                logger.info(f'{domain} matched pattern {pattern} in whitelist')
-                return True
+        if site is not None:
+            logger.info(f'{domain} matched {site} in whitelist')
+            return True
 
         return False
 
@@ -142,9 +208,53 @@ class NoTrackAnalytics():
         return False
 
 
+    def __get_newrows(self, ruleset):
+        """
+        Get range of dnslog ids added since a rule set was last run
+        Rows are checked from the start of the past hour when the rule set hasn't been run,
+        or when dnslog has been cleared since
+
+        Parameters:
+            ruleset (str): Name of rule set
+        Returns:
+            Last id checked or None, and newest id to check or None when dnslog is empty
+        """
+        lastid = self.__dbwrapper.analytics_getlastid(ruleset)
+        maxid = self.__dbwrapper.dnslog_getmaxid()
+
+        if maxid is None:                                  #Nothing to check
+            return lastid, None
+
+        if lastid is not None and lastid > maxid:          #dnslog ids have started again
+            lastid = None
+
+        logger.info(f'Checking dnslog ids {lastid} to {maxid} for {ruleset}')
+        return lastid, maxid
+
+
+    def __save_results(self, ruleset, maxid):
+        """
+        Save the reviewed results to dnslog and analytics tables in one transaction,
+        along with the newest dnslog id checked by the rule set
+        The id isn't moved on when saving fails, so the same rows are checked again next time,
+        and domains of the unsaved analytics records are forgotten so they can be added again
+
+        Parameters:
+            ruleset (str): Name of rule set
+            maxid (int): Newest dnslog id checked
+        """
+        if maxid is not None:
+            if not self.__dbwrapper.analytics_saveresults(self.__updates, self.__inserts, ruleset, maxid):
+                self.__domainsfound.difference_update(row[2] for row in self.__inserts)
+
+        self.__updates = list()
+        self.__inserts = list()
+
+
     def __review_results(self, issue, tabledata):
         """
         Check the results found before adding to the analytics table
+        Changes are held until __save_results
 
         Parameters:
             issue (str): Tracker, or Malware-x
@@ -184,37 +294,45 @@ class NoTrackAnalytics():
                     new_severity = '3'
 
             #Update dnslog record to show malware / tracker accessed instead of blocked / allowed
-            self.__dbwrapper.dnslog_updaterecord(row[0], new_severity, new_bl_source)
+            self.__updates.append((*row[:6], new_severity, new_bl_source))
 
             #Make sure that domain has not been added to analytics recently?
             if not self.__is_domainadded(row[3]):
                 self.__domainsfound.add(row[3])         #Add domain to domainsfound dict
                 #log_time, system, dns_request, analytics_severity, issue
-                self.__dbwrapper.analytics_insertrecord(row[1], row[2], row[3], analytics_severity, issue)
+                self.__inserts.append((row[1], row[2], row[3], analytics_severity, issue))
 
             print(f'{row[0]}, {row[1].isoformat(sep=" ")}, {row[3]}')
 
 
     def checkmalware(self):
         """
-        Check if any domains from all the enabled malware blocklists have been accessed
+        Check if any domains from all the enabled malware blocklists have been accessed or blocked
         """
+        blmatches = dict()                                 #Blocklist name: rows
+        bl = None
+        tabledata = []                                     #Results of MariaDB search
+
         print('Checking to see if any known malware domains have been accessed')
+        lastid, maxid = self.__get_newrows('malware')
 
-        if 'bl_notrack_malware' in self.__blocklists:
-            self.__searchmalware('bl_notrack_malware')
-        if 'bl_hexxium' in self.__blocklists:
-            self.__searchmalware('bl_hexxium')
-        if 'bl_cedia' in self.__blocklists:
-            self.__searchmalware('bl_cedia')
-        if 'bl_cedia_immortal' in self.__blocklists:
-            self.__searchmalware('bl_cedia_immortal')
-        if 'bl_malwaredomainlist' in self.__blocklists:
-            self.__searchmalware('bl_malwaredomainlist')
-        if 'bl_malwaredomains' in self.__blocklists:
-            self.__searchmalware('bl_malwaredomains')
-        if 'bl_swissransom' in self.__blocklists:
-            self.__searchmalware('bl_swissransom')
+        if len(self.__malware) == 0:                       #Move on last id, so old rows aren't checked once a list is enabled
+            logger.info('No malware blocklists active')
+        elif maxid is not None:
+            tabledata = self.__dbwrapper.dnslog_searchnew(lastid, maxid, blocked=True)
+
+        for row in tabledata:
+            bl = self.__malware.find(row[3])               #Domain or any parent domain in a malware blocklist
+            if bl is not None:
+                blmatches.setdefault(bl, []).append(row)
+
+        #Review in order of priority
+        for bl in MALWARE_BLOCKLISTS:
+            if bl in blmatches:
+                logger.info(f'Found {len(blmatches[bl])} results for domains from: {bl}')
+                self.__review_results(f'malware-{bl}', blmatches[bl])  #Specify name of malware list
+
+        self.__save_results('malware', maxid)
 
 
     def checktrackers(self):
@@ -222,34 +340,46 @@ class NoTrackAnalytics():
         Check if any accessed domains match known tracker or advertising patterns
         """
 
-        #Checks for Pixels, Telemetry, and Trackers
+        domainmatches = dict()                             #Domain: pattern position, each domain is only checked once
+        patternmatches = dict()                            #Pattern position: rows
+        patternpos = None
+        tabledata = []                                     #Results of MariaDB search
+
         print('Checking to see if any trackers or advertising domains have been accessed')
-        self.__searchregex('^analytics\\\.', 'tracker')                  #analytics as a subdomain
-        self.__searchregex('^cl(c|ck|icks?|kstat)\\\.', 'tracker')       #clc, clck, clicks?, clkstat as a subdomain
-        self.__searchregex('^log(s|ger)?\\\.', 'tracker')                #log, logs, logger as a subdomain (exclude login.)
-        self.__searchregex('^pxl?\\\.', 'tracker')                       #px, pxl, as a subdomain
-        self.__searchregex('pixel[^\\\.]{0,8}\\\.', 'tracker')           #pixel, followed by 0 to 8 non-dot chars anywhere
-        self.__searchregex('^s?metrics\\\.', 'tracker')                  #smetrics, metrics as a subdomain
-        self.__searchregex('telemetry', 'tracker')                       #telemetry anywhere
-        self.__searchregex('trk[^\\\.]{0,3}\\\.', 'tracker')             #trk, followed by 0 to 3 non-dot chars anywhere
-        #Have to exclude tracker. (bittorent), security-tracker (Debian), and tracking-protection (Mozilla)
-        self.__searchregex('^trace\\\.', 'tracker')                      #trace as a subdomain
-        self.__searchregex('track(ing|\\\-[a-z]{2,8})?\\\.', 'tracker')  #track, tracking, track-eu as a subdomain / domain.
-        self.__searchregex('^visit\\\.', 'tracker')                      #visit as a subdomain
-        self.__searchregex('^v?stats?\\\.', 'tracker')                   #vstat, stat, stats as a subdomain
-
-        #Checks for Advertising
-        self.__searchregex('^ads\\\.', 'advert')
-        self.__searchregex('^adserver', 'advert')
-        self.__searchregex('^advert', 'advert')
+        lastid, maxid = self.__get_newrows('trackers')
+
+        if maxid is not None:
+            tabledata = self.__dbwrapper.dnslog_searchnew(lastid, maxid)
+
+        for row in tabledata:
+            if row[3] in domainmatches:
+                patternpos = domainmatches[row[3]]
+            else:
+                patternpos = self.__match_tracker(row[3])
+                domainmatches[row[3]] = patternpos
+
+            if patternpos is not None:
+                patternmatches.setdefault(patternpos, []).append(row)
+
+        logger.info(f'Checked {len(domainmatches)} domains from {len(tabledata)} rows')
+
+        #Review in order of priority, so a domain matching several patterns is only reported once
+        for patternpos in sorted(patternmatches):
+            pattern, issue = TRACKER_PATTERNS[patternpos]
+            logger.info(f'Found {len(patternmatches[patternpos])} results for regular expression: {pattern}')
+            self.__review_results(issue, patternmatches[patternpos])
+
+        self.__save_results('trackers', maxid)
 
 
     def get_blocklists(self):
         """
-        Get active blocklists and whitelist
+        Get active blocklists and whitelist, and load the malware blocklist domains
+        Run after the blocklists have been updated
         """
         self.__blocklists = self.__dbwrapper.blocklist_getactive()
-        self.__whitelist = self.__dbwrapper.blocklist_getwhitelist()
+        self.__load_whitelist()
+        self.__load_malware()
 
 
 def main():
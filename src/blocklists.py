@@ -9,6 +9,7 @@ TYPE_PLAIN = 1
 TYPE_UNIXLIST = 2
 TYPE_EASYLIST = 4
 TYPE_CSV = 8
+TYPE_CUSTOM = 16                                           #Unknown type, used for users custom lists
 
 blocklistconf = {
     'bl_blacklist' : [True, '', TYPE_PLAIN],
@@ -7,6 +7,16 @@
 #Usage : sudo python notrack.py
 
 #Standard imports
+from array import array
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from hashlib import blake2b
+from itertools import islice
+from urllib.parse import urlparse
+import argparse
+import json
+import marshal
+import multiprocessing
 import os
 import shutil
 import sys
@@ -28,360 +38,592 @@ from statusconsts import *
 # Constants
 #######################################
 MAX_AGE = 172800 #2 days in seconds
+MAX_DOWNLOADS = 8                                          #Concurrent downloads in total
+MAX_HOST_DOWNLOADS = 2                                     #Concurrent downloads per host
+PARSED_VERSION = 2                                         #Format version of parsed cache files
 
-class BlockParser:
-    def __init__(self, dns_blockip):
-        print('Initialising Block List Parser')
 
-        self.bl_custom = ''
-        self.__dedupcount = 0                              #Per list deduplication count
-        self.__domaincount = 0                             #Per list of added domains
-        self.__totaldedupcount = 0
-        self.__dnsserver_blacklist = ''                    #String for DNS Server Blacklist file
-        self.__dnsserver_whitelist = ''                    #String for DNS Server Whitelist file
+def match_defanged(line):
+    """
+    Checks custom blocklist file line against Defanged List line regex
 
-        self.__blocklist = list()                          #List of tupples for the blocklist
-        self.__blockdomianset = set()                      #Domains in blocklist
-        self.__blocktldset = set()                         #TLDs blocked
-        self.__whiteset = set()                            #Domains in whitelist
+    Parameters:
+        line (str): Line from file
+    Returns:
+        Tuple of domain and comment on successful match
+        None when no match is found
+    """
+    matches = Regex_Defanged.search(line)                  #Search for first match
 
-        self.__services = Services()                       #Declare service class
-        self.__dbwrapper = DBWrapper()                     #Declare MariaDB Wrapper
+    if matches is not None:                                #Has a match been found?
+        #Group 1 - Domain and replace defanged [.] with .
+        return tuple([matches.group(1).replace('[.]', '.'), ''])
 
-        #Fill in users blacklist and tld list locations
-        blocklistconf['bl_blacklist'][1] = folders.blacklist
-        blocklistconf['bl_tld'][1] = folders.tldist
+    return None                                            #Nothing found
 
-        #Fill in __dnsserver_blacklist and __dnsserver_whitelist based on host IP
-        self.__get_hostdetails(dns_blockip)
 
+def match_easyline(line):
+    """
+    Checks custom blocklist file line against Easy List line regex
 
-    def __add_blacklist(self, domain):
-        """
-        Formatted string for a blacklist line
-        """
-        return self.__dnsserver_blacklist % domain
+    Parameters:
+        line (str): Line from file
+    Returns:
+        Tuple of domain and comment on successful match
+        None when no match is found
+    """
+    matches = Regex_EasyLine.search(line)                  #Search for first match
 
+    if matches is not None:                                #Has a match been found?
+        return tuple([matches.group(1), ''])               #Group 1 - Domain
 
-    def __add_whitelist(self, domain):
-        """
-        Formatted string for a whitelist line
-        """
-        return self.__dnsserver_whitelist % domain
+    return None                                            #Nothing found
 
 
-    def __get_hostdetails(self, dns_blockip):
+def match_plainline(line):
+    """
+    Checks custom blocklist file line against Plain List line regex
+
+    Parameters:
+        line (str): Line from file
+    Returns:
+        Tuple of domain and comment on successful match
+        None when no match is found
+    """
+    matches = Regex_PlainLine.search(line)                 #Search for first match
+
+    if matches is not None:                                #Has a match been found?
+        return tuple([matches.group(1), matches.group(2)])
+
+    return None                                            #Nothing found
+
+
+def match_unixline(line):
+    """
+    Checks custom blocklist file line against Unix List line regex
+
+    Parameters:
+        line (str): Line from file
+    Returns:
+        Tuple of domain and comment on successful match
+        None when no match is found
+    """
+    matches = Regex_UnixLine.search(line)                  #Search for first match
+
+    if matches is not None:                                #Has a match been found?
+        return tuple([matches.group(1), matches.group(2)])
+
+    return None                                            #Nothing found
+
+
+def parse_customlist(lines):
+    """
+    We don't know what type of list this is, so try regex match against different types
+
+    Parameters:
+        lines (iterable): Lines from file
+    Returns:
+        List of tuples [domain, comment]
+    """
+    candidates = list()
+
+    for line in lines:                                     #Read through list
+        #Try against Plain line, Easy List, Unix List, and finally Defanged
+        item = match_plainline(line) or match_easyline(line) or match_unixline(line) or match_defanged(line)
+        if item is not None:
+            candidates.append(item)
+
+    return candidates
+
+
+def parse_csv(lines):
+    """
+    List of domains in a CSV file, assuming cell 1 = domain, cell 2 = comment
+
+    Parameters:
+        lines (iterable): Lines from file
+    Returns:
+        List of tuples [domain, comment]
+    """
+    candidates = list()
+
+    for line in lines:                                     #Read through list
+        matches = Regex_CSV.match(line)
+
+        if matches is not None:                            #Has a match been found?
+            #Group 1 - Domain, Group 2 - Comment
+            candidates.append(tuple([matches.group(1), matches.group(2)]))
+
+    return candidates
+
+
+def parse_easylist(lines):
+    """
+    List of domains in Adblock+ filter format [https://adblockplus.org/filter-cheatsheet]
+
+    Parameters:
+        lines (iterable): Lines from file
+    Returns:
+        List of tuples [domain, comment]
+    """
+    candidates = list()
+
+    for line in lines:                                     #Read through list
+        matches = Regex_EasyLine.search(line)              #Search for first match
+
+        if matches is not None:                            #Has a match been found?
+            candidates.append(tuple([matches.group(1), ''])) #Group 1 - Domain
+
+    return candidates
+
+
+def parse_plainlist(lines):
+    """
+    List of domains with optional # separated comments
+
+    Parameters:
+        lines (iterable): Lines from file
+    Returns:
+        List of tuples [domain, comment]
+    """
+    candidates = list()
+    splitline = list()
+
+    for line in lines:                                     #Read through list
+        splitline = line.split('#', 1)                     #Split by hash delimiter
+
+        if splitline[0] == '\n' or splitline[0] == '':     #Ignore Comment line or Blank
+            continue
+
+        if len(splitline) > 1:                             #Line has a comment
+            candidates.append(tuple([splitline[0][:-1], splitline[1][:-1]]))
+
+        else:                                              #No comment, leave it blank
+            candidates.append(tuple([splitline[0][:-1], '']))
+
+    return candidates
+
+
+def parse_unixlist(lines):
+    """
+    List of domains starting with either 0.0.0.0 or 127.0.0.1 domain.com
+
+    Parameters:
+        lines (iterable): Lines from file
+    Returns:
+        List of tuples [domain, comment]
+    """
+    candidates = list()
+
+    for line in lines:                                     #Read through list
+        matches = Regex_UnixLine.search(line)              #Search for first match
+
+        if matches is not None:                            #Has a match been found?
+            candidates.append(tuple([matches.group(1), ''])) #Group 1 - Domain
+
+    return candidates
+
+
+PARSERS = {
+    TYPE_PLAIN: parse_plainlist,
+    TYPE_UNIXLIST: parse_unixlist,
+    TYPE_EASYLIST: parse_easylist,
+    TYPE_CSV: parse_csv,
+    TYPE_CUSTOM: parse_customlist,
+}
+
+
+def load_candidates(blname, blfilename, bltype):
+    """
+    Extract domains and comments from a block list file
+    Results are cached in temp folder, keyed by list name and content hash,
+    so an unchanged list is loaded without carrying out any regex matching
+    1. Get the content hash of the list
+    2. Load the parsed cache if it matches the hash and list type
+    3. Otherwise stream file through the parser for its type, then save the parsed cache
+
+    Parameters:
+        blname (str): Block list name
+        blfilename (str): Block list file name
+        bltype (int): Block list type
+    Returns:
+        List of tuples [domain, comment]
+        Empty list if the file is missing or empty
+    """
+    cachefile = f'{folders.tempdir}/{blname}.parsed'
+    candidates = list()
+    filehash = ''
+
+    filehash, filesize = get_filehash(blfilename)
+
+    if filesize == 0:                                      #Missing or empty
+        return []
+
+    try:
+        with open(cachefile, 'rb') as f:
+            cached = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):     #No cache or unreadable cache
+        cached = None
+
+    if isinstance(cached, tuple) and cached[:3] == (PARSED_VERSION, bltype, filehash):
+        print(f'{blfilename} unchanged, loaded {len(cached[3])} domains from parsed cache')
+        return cached[3]
+
+    candidates = PARSERS[bltype](read_lines(blfilename, use_mmap=True))
+
+    try:
+        with open(cachefile, 'wb') as f:
+            marshal.dump(tuple([PARSED_VERSION, bltype, filehash, candidates]), f)
+    except OSError as e:
+        print(f'Unable to save parsed cache for {blname}: {e}', file=sys.stderr)
+
+    return candidates
+
+
+if sys.hash_info.width >= 64:
+    domain_key = hash                                      #64 bit hash of a str, cached by the str
+else:
+    def domain_key(domain):
         """
-        Get Host Name and IP address for __dnsserver_blacklist and __dnsserver_whitelist
+        64 bit key of a domain for builds with a 32 bit hash(), e.g. armhf
+        A 32 bit hash would make most lookups collide between millions of domains
         """
-        host = Host(dns_blockip)                   #Declare host class
-        print(f'Hostname: {host.name}, IP Address: {host.ip}')
+        return int.from_bytes(blake2b(domain.encode(), digest_size=8).digest(), 'little', signed=True)
+
+
+class BlockList:
+    """
+    Compact storage for the in-flight blocklist
+    Domains are packed into one contiguous buffer with offsets, sources and comments are
+    stored once and referenced by small integer ids from arrays
+    Membership is checked with an open addressing hash table of domain numbers, which can be
+    searched by parent domain in the same way as SuffixIndex
+    A key match is confirmed against the packed domain, so a key collision can't drop a domain
+    """
+    def __init__(self):
+        self.__buffer = bytearray()                        #Packed domains
+        self.__offsets = array('I', [0])                   #Domain n is __buffer[__offsets[n]:__offsets[n+1]]
+        self.__sourceids = array('H')                      #Source id of each domain
+        self.__commentids = array('I')                     #Comment id of each domain
+        self.__sources = list()                            #Source names by id
+        self.__sourcelookup = dict()                       #Source name: id
+        self.__comments = ['']                             #Comments by id
+        self.__commentlookup = {'': 0}                     #Comment: id
+        self.__keys = array('q')                           #domain_key of each domain without leading dot
+        self.__slots = array('I', bytes(4 * 1024))         #Hash table of domain number + 1, zero is empty
+
+
+    def __len__(self):
+        return len(self.__sourceids)
+
+
+    def __getid(self, value, values, lookup):
+        """
+        Get id of value, adding it to values and lookup if new
+        """
+        valueid = lookup.get(value)
 
-        #Setup the template strings for writing out to black/white list files
-        [self.__dnsserver_blacklist, self.__dnsserver_whitelist] = self.__services.get_dnstemplatestr(host.name, host.ip)
+        if valueid is None:
+            valueid = len(values)
+            values.append(value)
+            lookup[value] = valueid
 
+        return valueid
 
-    def __extract_list(self, sourcezip, destination):
-        """
-        Unzip a file to destination
 
-        Parameters:
-            sourcezip (str): Zip file
-            destination (str): Output destination
+    def __insert_slot(self, slots, key, n):
         """
-        from zipfile import ZipFile
+        Put domain number n into the first empty slot from its key, using linear probing
+        """
+        mask = len(slots) - 1
+        i = key & mask
 
-        with ZipFile(sourcezip) as zipobj:
-            for compressedfile in zipobj.namelist():
-                if compressedfile.endswith('.txt'):
-                    zipobj.extract(compressedfile, f'{folders.tempdir}/')
-                    print(f'Extracting {compressedfile}')
-                    move_file(f'{folders.tempdir}/{compressedfile}', destination)
+        while slots[i] != 0:
+            i = (i + 1) & mask
 
+        slots[i] = n + 1
 
-    def __add_domain(self, subdomain, comment, source):
-        """
-        Process supplied domain and add it to self.__blocklist
-        1. Extract domain.co.uk from say subdomain.domain.co.uk
-        2. Check if domain.co.uk is in self.__blockdomianset
-        3. If subdomain is actually a domain then record domain in self.__blockdomianset
-        4. Reverse subdomain
-        5. Append to self.__blocklist as [reverse, subdomain, comment, source]
 
-        Parameters:
-            subdomain (str): Subdomain or domain
-            comment (str): A comment
-            source (str): Block list name
+    def __grow(self):
         """
-        reverse = ''                                       #Reversed domain
+        Double the hash table, keeping it no more than two thirds full so probes stay short
+        """
+        slots = array('I', bytes(8 * len(self.__slots)))
 
-        matches = Regex_Domain.search(subdomain)
+        for n, key in enumerate(self.__keys):
+            self.__insert_slot(slots, key, n)
 
-        if matches == None:                                #Could be a TLD instead?
-            self.__add_tld(subdomain, comment, source)
-            return
+        self.__slots = slots
 
-        if matches.group(0) in self.__blockdomianset:      #Blocked by domain or whitelisted?
-            #print('\t%s is already in self.__blockdomianset as %s' % (subdomain, matches.group(0)))
-            self.__dedupcount += 1
-            self.__totaldedupcount += 1
-            return
 
-        if matches.group(2) in self.__blocktldset:         #Blocked by TLD?
-            #print('\t%s is blocked by TLD as %s' % (subdomain, matches.group(2)))
-            return
+    def __contains(self, domain):
+        """
+        Check if domain without leading dot is in the hash table
 
-        if matches.group(0) == subdomain:                  #Add domain.co.uk to self.__blockdomianset
-            #print('Adding domain %s' % subdomain)
-            self.__blockdomianset.add(subdomain)
+        Parameters:
+            domain (str): Domain without leading dot
+        Returns:
+            True when domain has been added
+        """
+        key = domain_key(domain)
+        keys = self.__keys
+        slots = self.__slots
+        mask = len(slots) - 1
+        i = key & mask
+        encoded = None
+
+        while slots[i] != 0:
+            n = slots[i] - 1
+            if keys[n] == key:                             #Confirm the domain, as keys can collide
+                if encoded is None:
+                    encoded = domain.encode()
+                if self.__buffer[self.__offsets[n]:self.__offsets[n + 1]].lstrip(b'.') == encoded:
+                    return True
+            i = (i + 1) & mask
 
-        #Reverse the domain for later sorting and deduplication
-        #An Extra dot is required to match other subdomains and avoid similar spellings
-        reverse = subdomain[::-1] + '.'
-        self.__blocklist.append(tuple([reverse, subdomain, comment, source]))
-        self.__domaincount += 1
+        return False
 
 
-    def __add_tld(self, tld, comment, source):
+    def add(self, domain, comment, source):
         """
-        Process TLD and add it to __blocktldset
+        Add domain to the blocklist
 
         Parameters:
-            tld (str): A possible Top Level Domain
+            domain (str): Domain or Top Level Domain
             comment (str): A comment
             source (str): Block list name
         """
-        matches = Regex_TLD.search(tld)
+        key = domain_key(domain.lstrip('.'))
 
-        if matches == None:                                #Don't know what it is
-            return
+        if 3 * (len(self.__keys) + 1) > 2 * len(self.__slots):
+            self.__grow()
+
+        self.__insert_slot(self.__slots, key, len(self.__keys))
+        self.__keys.append(key)
+        self.__buffer += domain.encode()
+        self.__offsets.append(len(self.__buffer))
+        self.__sourceids.append(self.__getid(source, self.__sources, self.__sourcelookup))
+        self.__commentids.append(self.__getid(comment, self.__comments, self.__commentlookup))
 
-        self.__blocktldset.add(tld)
-        reverse = tld[::-1] + '.'
-        self.__blocklist.append(tuple([reverse, tld, comment, source]))
-        self.__domaincount += 1
 
-    def __match_defanged(self, line, listname):
+    def find(self, domain):
         """
-        Checks custom blocklist file line against Defanged List line regex
+        Check if domain, or any of its parent domains are in the blocklist
 
         Parameters:
-            line (str): Line from file
-            listname (str): Blocklist name
+            domain (str): Domain to search for
         Returns:
-            True on successful match
-            False when no match is found
+            True when domain is blocked
         """
-        matches = Regex_Defanged.search(line)                  #Search for first match
+        domain = domain.lstrip('.')
+        pos = 0
 
-        if matches is not None:                                #Has a match been found?
-            #Add group 1 - Domain and replace defanged [.] with .
-            self.__add_domain(matches.group(1).replace('[.]', '.'), '', listname)
-            return True
+        while pos != -1:                                   #Read labels from left to right
+            if self.__contains(domain[pos:]):
+                return True
+            pos = domain.find('.', pos) + 1 or -1
 
-        return False                                           #Nothing found, return False
+        return False
 
 
-    def __match_easyline(self, line, listname):
+    def find_parent(self, domain):
         """
-        Checks custom blocklist file line against Easy List line regex
+        Check if any parent domain, excluding domain itself, is in the blocklist
 
         Parameters:
-            line (str): Line from file
-            listname (str): Blocklist name
+            domain (str): Domain to search for
         Returns:
-            True on successful match
-            False when no match is found
+            True when a parent of domain is blocked
         """
-        matches = Regex_EasyLine.search(line)                  #Search for first match
+        domain = domain.lstrip('.')
+        pos = domain.rfind('.')
 
-        if matches is not None:                                #Has a match been found?
-            self.__add_domain(matches.group(1), '', listname)  #Add group 1 - Domain
-            return True
+        while pos != -1:                                   #Read labels from right to left
+            if self.__contains(domain[pos + 1:]):
+                return True
+            pos = domain.rfind('.', 0, pos)
 
-        return False                                           #Nothing found, return False
+        return False
 
 
-    def __match_plainline(self, line, listname):
+    def items(self):
+        """
+        Generator of each domain, comment, and source in order they were added
         """
-        Checks custom blocklist file line against Plain List line regex
+        for i in range(len(self.__sourceids)):
+            domain = self.__buffer[self.__offsets[i]:self.__offsets[i + 1]].decode()
+            yield tuple([domain, self.__comments[self.__commentids[i]], self.__sources[self.__sourceids[i]]])
+
 
+class BlockParser:
+    def __init__(self, dns_blockip, workers=1):
+        """
         Parameters:
-            line (str): Line from file
-            listname (str): Blocklist name
-        Returns:
-            True on successful match
-            False when no match is found
+            dns_blockip (str): IP address to return for blocked domains
+            workers (int): Number of processes to parse block lists with, 1 for serial parsing
         """
-        matches = Regex_PlainLine.search(line)                 #Search for first match
+        print('Initialising Block List Parser')
 
-        if matches is not None:                                #Has a match been found?
-            self.__add_domain(matches.group(1), matches.group(2), listname)
-            return True
+        self.bl_custom = ''
+        self.__workers = max(1, workers)                   #Block list parsing processes
+        self.__dedupcount = 0                              #Per list deduplication count
+        self.__domaincount = 0                             #Per list of added domains
+        self.__totaldedupcount = 0
+        self.__dnslists_changed = False                    #Do the DNS Server lists need reloading?
+        self.__dnsserver_blacklist = ''                    #String for DNS Server Blacklist file
+        self.__dnsserver_whitelist = ''                    #String for DNS Server Whitelist file
+
+        self.__blocklist = BlockList()                     #Compact list of domains, comments, sources
+        self.__sqldata = list()                            #Rows for blocklist table
+        self.__blocktldset = set()                         #TLDs blocked
+        self.__whiteset = set()                            #Domains in whitelist
+
+        self.__services = Services()                       #Declare service class
+        self.__dbwrapper = DBWrapper()                     #Declare MariaDB Wrapper
 
-        return False                                           #Nothing found, return False
+        #Fill in users blacklist and tld list locations
+        blocklistconf['bl_blacklist'][1] = folders.blacklist
+        blocklistconf['bl_tld'][1] = folders.tldist
+
+        #Fill in __dnsserver_blacklist and __dnsserver_whitelist based on host IP
+        self.__get_hostdetails(dns_blockip)
 
 
-    def __match_unixline(self, line, listname):
+    def __save_dnslist(self, lines, filename):
         """
-        Checks custom blocklist file line against Unix List line regex
+        Save a DNS Server list file, only when its contents have changed
+        Lines are sorted, so the next save can be compared against the file line by line
+        Summary of changes is shown, and __dnslists_changed is set when a reload is needed
 
         Parameters:
-            line (str): Line from file
-            listname (str): Blocklist name
-        Returns:
-            True on successful match
-            False when no match is found
+            lines (list): Lines for the DNS Server, sorted in place
+            filename (str): File to save to
         """
-        matches = Regex_UnixLine.search(line)                  #Search for first match
+        lines.sort()
+        changes = compare_file(lines, filename)
 
-        if matches is not None:                                #Has a match been found?
-            self.__add_domain(matches.group(1), matches.group(2), listname)
-            return True
+        if changes == (0, 0) and os.path.isfile(filename):
+            print(f'No changes to {filename}')
+            return
 
-        return False                                           #Nothing found, return False
+        if changes is None:                                #Unsorted file from an older version
+            print(f'Updating {filename}')
+        else:
+            print(f'Updating {filename}: {changes[0]} added, {changes[1]} removed')
+        if save_file_atomic(lines, filename):
+            self.__dnslists_changed = True
 
 
-    def __process_customlist(self, lines, listname):
+    def __delete_dnslist(self, filename):
         """
-        We don't know what type of list this is, so try regex match against different types
-        1. Reset dedup and domain counters
-        2. Read list of lines
-        3. Try different regex matches
+        Delete a DNS Server list file, setting __dnslists_changed if it existed
 
         Parameters:
-            lines (list): List of lines
-            listname (str): Blocklist name
+            filename (str): File to delete
         """
-        self.__dedupcount = 0                              #Reset per list dedup count
-        self.__domaincount = 0                             #Reset per list domain count
+        if delete(filename):
+            self.__dnslists_changed = True
 
-        print(f'{len(lines)} lines to process')
 
-        for line in lines:                                 #Read through list
-            if self.__match_plainline(line, 'custom'):     #Try against Plain line
-                continue
-            if self.__match_easyline(line, 'custom'):      #Try agaisnt Easy List
-                continue
-            if self.__match_unixline(line, 'custom'):      #Try against Unix List
-                continue
-            self.__match_defanged(line, 'custom')          #Finally try against Defanged
-
-        print(f'Added {self.__domaincount} domains')       #Show stats for the list
-        print(f'Deduplicated {self.__dedupcount} domains')
+    def __add_blacklist(self, domain):
+        """
+        Formatted string for a blacklist line
+        """
+        return self.__dnsserver_blacklist % domain
 
 
-    def __process_csv(self, filelines, listname):
+    def __add_whitelist(self, domain):
         """
-        List of domains in a CSV file, assuming cell 1 = domain, cell 2 = comment
-        1. Reset dedup and domain counters
-        2. Read list of filelines
-        3. Check regex match against Regex_CSV
-        4. Add domain and comment
-
-        Parameters:
-            filelines (list): List of lines from file to being processed
-            listname (str): Blocklist name
+        Formatted string for a whitelist line
         """
-        self.__dedupcount = 0                              #Reset per list dedup count
-        self.__domaincount = 0                             #Reset per list domain count
-
-        print(f'{len(filelines)} lines to process')
+        return self.__dnsserver_whitelist % domain
 
-        for line in filelines:                                 #Read through list
-            matches = Regex_CSV.match(line)
 
-            if matches is not None:                        #Has a match been found?
-                #Add Group 1 - Domain, Group 2 - Comment
-                self.__add_domain(matches.group(1), matches.group(2), listname)
+    def __get_hostdetails(self, dns_blockip):
+        """
+        Get Host Name and IP address for __dnsserver_blacklist and __dnsserver_whitelist
+        """
+        host = Host(dns_blockip)                   #Declare host class
+        print(f'Hostname: {host.name}, IP Address: {host.ip}')
 
-        print(f'Added {self.__domaincount} domains')       #Show stats for the list
-        print(f'Deduplicated {self.__dedupcount} domains')
+        #Setup the template strings for writing out to black/white list files
+        [self.__dnsserver_blacklist, self.__dnsserver_whitelist] = self.__services.get_dnstemplatestr(host.name, host.ip)
 
 
-    def __process_easylist(self, lines, listname):
+    def __add_domain(self, subdomain, comment, source):
         """
-        List of domains in Adblock+ filter format [https://adblockplus.org/filter-cheatsheet]
-        1. Reset dedup and domain counters
-        2. Read list of lines
-        3. Check regex match against Regex_EasyLine
-        4. Add domain
+        Process supplied domain and add it to self.__blocklist
+        1. Extract domain.co.uk from say subdomain.domain.co.uk
+        2. Check if domain.co.uk is in self.__whiteset
+        3. Check if subdomain or any of its parents (including domain.co.uk and TLD) are already blocked
+        4. Add to self.__blocklist as subdomain: [subdomain, comment, source]
 
         Parameters:
-            lines (list): List of lines
-            listname (str): Blocklist name
+            subdomain (str): Subdomain or domain
+            comment (str): A comment
+            source (str): Block list name
         """
-        self.__dedupcount = 0                              #Reset per list dedup count
-        self.__domaincount = 0                             #Reset per list domain count
+        matches = Regex_Domain.search(subdomain)
 
-        print(f'{len(lines)} lines to process')
+        if matches == None:                                #Could be a TLD instead?
+            self.__add_tld(subdomain, comment, source)
+            return
 
-        for line in lines:                                 #Read through list
-            matches = Regex_EasyLine.search(line)          #Search for first match
+        if matches.group(0) in self.__whiteset:            #Whitelisted?
+            self.__dedupcount += 1
+            self.__totaldedupcount += 1
+            return
 
-            if matches is not None:                        #Has a match been found?
-                self.__add_domain(matches.group(1), '', listname)     #Add group 1 - Domain
+        if self.__blocklist.find(subdomain):               #Already blocked by itself, parent, or TLD?
+            self.__dedupcount += 1
+            self.__totaldedupcount += 1
+            return
 
-        print(f'Added {self.__domaincount} domains')       #Show stats for the list
-        print(f'Deduplicated {self.__dedupcount} domains')
+        self.__blocklist.add(subdomain, comment, source)
+        self.__domaincount += 1
 
 
-    def __process_plainlist(self, lines, listname):
+    def __add_tld(self, tld, comment, source):
         """
-        List of domains with optional # separated comments
-        1. Reset dedup and domain counters
-        2. Read list of lines
-        3. Split each line by hash delimiter
-        4. Add domain
+        Process TLD and add it to __blocktldset and self.__blocklist
+        Any domains added afterwards under this TLD are dropped by self.__blocklist
 
         Parameters:
-            lines (list): List of lines
-            listname (str): Blocklist name
+            tld (str): A possible Top Level Domain
+            comment (str): A comment
+            source (str): Block list name
         """
-        splitline = list()
-
-        self.__dedupcount = 0                              #Reset per list dedup count
-        self.__domaincount = 0                             #Reset per list domain count
-
-        print(f'{len(lines)} lines to process')
-
-        for line in lines:                                 #Read through list
-            splitline = line.split('#', 1)                 #Split by hash delimiter
-
-            if splitline[0] == '\n' or splitline[0] == '': #Ignore Comment line or Blank
-                continue
+        matches = Regex_TLD.search(tld)
 
-            if len(splitline) > 1:                         #Line has a comment
-                self.__add_domain(splitline[0][:-1], splitline[1][:-1], listname)
+        if matches == None:                                #Don't know what it is
+            return
 
-            else:                                          #No comment, leave it blank
-                self.__add_domain(splitline[0][:-1], '', listname)
+        if self.__blocklist.find(tld):                     #Already blocked?
+            self.__dedupcount += 1
+            self.__totaldedupcount += 1
+            return
 
-        print(f'Added {self.__domaincount} domains')       #Show stats for the list
-        print(f'Deduplicated {self.__dedupcount} domains')
+        self.__blocktldset.add(tld)
+        self.__blocklist.add(tld, comment, source)
+        self.__domaincount += 1
 
 
-    def __process_unixlist(self, lines, listname):
+    def __add_domains(self, candidates, listname):
         """
-        List of domains starting with either 0.0.0.0 or 127.0.0.1 domain.com
+        Add domains extracted from a list to the blocklist
         1. Reset dedup and domain counters
-        2. Read list of lines
-        3. Check regex match against Regex_UnixLine
-        4. Add domain
+        2. Add each domain and comment
+        3. Show stats for the list
+
         Parameters:
-            lines (list): List of lines
+            candidates (list): List of tuples [domain, comment]
             listname (str): Blocklist name
         """
-
         self.__dedupcount = 0                              #Reset per list dedup count
         self.__domaincount = 0                             #Reset per list domain count
 
-        print(f'{len(lines)} lines to process')
-
-        for line in lines:                                 #Read through list
-            matches = Regex_UnixLine.search(line)          #Search for first match
-            if matches is not None:                        #Has a match been found?
-                self.__add_domain(matches.group(1), '', listname)  #Add group 1 - Domain
+        for domain, comment in candidates:
+            self.__add_domain(domain, comment, listname)
 
         print(f'Added {self.__domaincount} domains')       #Show stats for the list
         print(f'Deduplicated {self.__dedupcount} domains')
@@ -389,44 +631,34 @@ class BlockParser:
 
     def __process_whitelist(self):
         """
-        Load items from whitelist file into self.__blockdomianset array
-            (A domain being in the self.__blocklist will prevent it from being added later)
+        Load items from whitelist file into self.__whiteset
+            (A domain being in the self.__whiteset will prevent it from being added later)
         """
         whitedict_len = 0
-        sqldata = list()
         splitline = list()
 
         print('Processing whitelist:')
 
-        filelines = load_file(folders.whitelist)    #Load White list
-
-        if filelines == None:
-            print('Nothing in whitelist')
-            delete(folders.dnslists + 'whitelist.list')
-            return
-
-        for line in filelines:                             #Process each line
+        for line in read_lines(folders.whitelist):         #Process each line of White list
             splitline = line.split('#', 1)
             if splitline[0] == '\n' or splitline[0] == '': #Ignore Comment line or Blank
                 continue
 
-            self.__blockdomianset.add(splitline[0][:-1])
             self.__whiteset.add(splitline[0][:-1])
 
             if len(splitline) > 1:                         #Line has a comment
-                sqldata.append(tuple(['whitelist', splitline[0][:-1], True, splitline[1][:-1]]))
+                self.__sqldata.append(tuple(['whitelist', splitline[0][:-1], True, splitline[1][:-1]]))
             else:                                          #No comment, leave it blank
-                sqldata.append(tuple(['whitelist', splitline[0][:-1], True, '']))
+                self.__sqldata.append(tuple(['whitelist', splitline[0][:-1], True, '']))
 
         #Count number of domains white listed
         whitedict_len = len(self.__whiteset)
 
         if whitedict_len > 0:
             print(f'Number of domains in whitelist: {whitedict_len}')
-            self.__dbwrapper.blocklist_insertdata(sqldata)
         else:
             print('Nothing in whitelist')
-            delete(folders.dnslists + 'whitelist.list')
+            self.__delete_dnslist(folders.dnslists + 'whitelist.list')
         print()
 
 
@@ -446,11 +678,11 @@ class BlockParser:
 
         if len(filelines) > 0:                         #Any domains in whitelist?
             print(f'{len(filelines)} domains added to whitelist in order avoid block from TLD')
-            save_file(filelines, folders.dnslists + 'whitelist.list')
+            self.__save_dnslist(filelines, folders.dnslists + 'whitelist.list')
 
         else:
             print('No domains require whitelisting')
-            delete(folders.dnslists + 'whitelist.list')
+            self.__delete_dnslist(folders.dnslists + 'whitelist.list')
 
         self.__whiteset.clear()                            #self.__whiteset no longer required
         print()
@@ -484,7 +716,7 @@ class BlockParser:
     def __download_list(self, url, listname, destination):
         """
         Download file
-        Request file is unzipped (if necessary)
+        Compressed files (zip, gzip, xz) are decompressed whilst downloading
 
         Parameters:
             url (str): URL
@@ -494,184 +726,347 @@ class BlockParser:
             True success
             False failed download
         """
-        extension = ''
-        outputfile = ''
+        decompress = ''                                    #Compression type
+        cacheinfo = dict()                                 #Metadata from previous download
 
-        #Prepare for writing downloaded file to temp folder
         if url.endswith('zip'):                            #Check file extension
-            extension = 'zip'
-            outputfile = f'{folders.tempdir}/{listname}.zip'
+            decompress = 'zip'
+        elif url.endswith('.gz'):
+            decompress = 'gzip'
+        elif url.endswith('.xz'):
+            decompress = 'xz'
 
-        else:                                              #Other - Assume txt for output
-            extension = 'txt'
-            outputfile = destination
+        cacheinfo = self.__load_metadata(listname, url, destination)
 
-        if not download_file(url, outputfile):
+        if not download_file(url, destination, cacheinfo, decompress):
             return False
 
-        if extension == 'zip':                             #Extract zip file?
-            self.__extract_list(outputfile, destination)
+        if cacheinfo['modified']:                          #Save metadata for a new copy
+            cacheinfo['url'] = url
+            self.__save_metadata(listname, cacheinfo)
 
         return True
 
 
-    def __action_lists(self):
+    def __load_metadata(self, listname, url, destination):
         """
-        Go through config and process each enabled list
-        1. Skip disabled lists
-        2. Check if list is downloaded or locally stored
-        3. For downloaded lists
-        3a. Check file age
-        3b. Download new copy if out of date
-        4. Read file into filelines list
-        5. Process list based on type
-        """
-        blname = ''                                        #Block list name (shortened)
-        blenabled = False
-        blurl = ''                                         #Block list URL
-        bltype = ''                                        #Block list type
-        blfilename = ''                                    #Block list file name
+        Load metadata about the previous download of a list
+        Metadata is discarded if the URL has changed or the local file doesn't match it,
+        which will force a full download
 
-        for bl in blocklistconf.items():
-            blname = bl[0]
-            blenabled = bl[1][0]
-            blurl = bl[1][1]
-            bltype = bl[1][2]
+        Parameters:
+            listname (str): List name
+            url (str): URL
+            destination (str): File destination
+        Returns:
+            Dictionary of url, etag, lastmodified, hash, size
+            Empty dictionary if there is no usable metadata
+        """
+        metadata = dict()
+        metafile = f'{folders.tempdir}/{listname}.meta'
 
-            if not blenabled:                              #Skip disabled blocklist
-                continue
+        if not os.path.isfile(metafile) or not os.path.isfile(destination):
+            return dict()
 
-            print(f'Processing {blname}:')
+        try:
+            with open(metafile, 'r') as f:
+                metadata = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f'Unable to read metadata for {listname}: {e}', file=sys.stderr)
+            return dict()
 
-            #Is this a downloadable file or locally stored?
-            if blurl.startswith('http') or blurl.startswith('ftp'):
-                blfilename = f'{folders.tempdir}/{blname}.txt' #Download to temp folder
-                if self.__check_file_age(blfilename):                 #Does file need freshening?
-                    self.__download_list(blurl, blname, blfilename)
+        if metadata.get('url') != url:                     #List has moved
+            return dict()
 
-            else:                                          #Local file
-                blfilename = blurl;                        #URL is actually the filename
+        if metadata.get('size') != os.path.getsize(destination):
+            print(f'{destination} does not match metadata, ignoring it')
+            return dict()
 
-            filelines = load_file(blfilename)              #Read temp file
+        return metadata
 
-            if not filelines:                              #Anything read from file?
-                print(f'Data missing unable to process {blname}')
-                print()
-                continue
 
-            if bltype == TYPE_PLAIN:
-                self.__process_plainlist(filelines, blname)
-            elif bltype == TYPE_EASYLIST:
-                self.__process_easylist(filelines, blname)
-            elif bltype == TYPE_UNIXLIST:
-                self.__process_unixlist(filelines, blname)
-            elif bltype == TYPE_CSV:
-                self.__process_csv(filelines, blname)
+    def __save_metadata(self, listname, metadata):
+        """
+        Save metadata about the download of a list next to the downloaded file
+
+        Parameters:
+            listname (str): List name
+            metadata (dict): Dictionary of url, etag, lastmodified, hash, size
+        """
+        metafile = f'{folders.tempdir}/{listname}.meta'
+
+        try:
+            with open(metafile, 'w') as f:
+                json.dump(metadata, f)
+        except OSError as e:
+            print(f'Unable to save metadata for {listname}: {e}', file=sys.stderr)
 
-            print(f'Finished processing {blname}')
-            print()
 
+    def __is_downloadable(self, blurl):
+        """
+        Is this a downloadable file or locally stored?
 
-    def __action_customlists(self):
+        Parameters:
+            blurl (str): Block list URL or file path
+        Returns:
+            True for a URL, False for a local file
         """
-        Go through config and process each enabled list
-        1. Skip disabled lists
-        2. Check if list is downloaded or locally stored
-        3. For downloaded lists
-        3a. Check file age
-        3b. Download new copy if out of date
-        4. Read file into filelines list
-        5. Process list based on type
+        return blurl.startswith('http') or blurl.startswith('ftp')
+
+
+    def __get_customlists(self):
         """
-        blname = ''
-        blurl = ''                                         #Block list URL
-        blfilename = ''                                    #Block list file name
-        i = 0                                              #Loop position (for naming)
-        customurllist = list()
+        Split the comma seperated bl_custom setting into a list of names and URLs
+        Names are made up from the position in the list, e.g. bl_custom1
+
+        Returns:
+            List of tuples [blname, blurl]
+        """
+        customlists = list()
 
-        print('Processing Custom Blocklists:')
         if self.bl_custom == '':
-            print('No custom blocklists files or URLs set')
+            return customlists
+
+        for i, blurl in enumerate(self.bl_custom.split(','), start=1):
+            customlists.append(tuple([f'bl_custom{i}', blurl]))
+
+        return customlists
+
+
+    def __next_downloads(self, hostqueues, hostactive, running):
+        """
+        Take jobs which can start now from the per host queues
+        Hosts take turns, so one host with many lists doesn't hold up the others
+
+        Parameters:
+            hostqueues (dict): Host: deque of [url, listname, destination] waiting
+            hostactive (dict): Host: number of downloads running
+            running (int): Total number of downloads running
+        Returns:
+            List of tuples [host, url, listname, destination]
+        """
+        jobs = list()
+        added = True
+
+        while added and running + len(jobs) < MAX_DOWNLOADS:
+            added = False
+            for host, queue in hostqueues.items():
+                if running + len(jobs) >= MAX_DOWNLOADS:
+                    break
+                if queue and hostactive[host] < MAX_HOST_DOWNLOADS:
+                    jobs.append(tuple([host, *queue.popleft()]))
+                    hostactive[host] += 1
+                    added = True
+
+        return jobs
+
+
+    def __download_lists(self):
+        """
+        Download all enabled lists which are out of date concurrently
+        1. Gather enabled downloadable lists (default and custom)
+        2. Check file age to find which lists need freshening
+        3. Download stale lists using a bounded thread pool, queued per host so no more than
+           MAX_HOST_DOWNLOADS run at once for each host
+        Processing of lists happens afterwards in order of blocklistconf
+        """
+        downloads = list()                                 #List of [url, listname, destination]
+        futures = list()                                   #Finished downloads
+        hostactive = dict()                                #Number of downloads running for each host
+        hostqueues = dict()                                #Downloads waiting for each host
+        running = dict()                                   #Running download future: host
+
+        print('Checking for out of date block lists:')
+
+        for blname, blconf in blocklistconf.items():
+            if blconf[0] and self.__is_downloadable(blconf[1]):
+                downloads.append(tuple([blconf[1], blname, f'{folders.tempdir}/{blname}.txt']))
+
+        for blname, blurl in self.__get_customlists():
+            if self.__is_downloadable(blurl):
+                downloads.append(tuple([blurl, blname, f'{folders.tempdir}/{blname}.txt']))
+
+        #Only download files which need freshening
+        downloads = [item for item in downloads if self.__check_file_age(item[2])]
+
+        if len(downloads) == 0:
+            print('Nothing to download')
             print()
             return
 
-        customurllist = self.bl_custom.split(',')          #Explode comma seperated vals
+        for url, listname, destination in downloads:
+            host = urlparse(url).hostname
+            hostqueues.setdefault(host, deque()).append(tuple([url, listname, destination]))
+            hostactive[host] = 0
+
+        print(f'Downloading {len(downloads)} block lists')
+
+        #A download is only started when its host has a free slot, so pool threads never wait on a host
+        with ThreadPoolExecutor(max_workers=MAX_DOWNLOADS) as executor:
+            while True:
+                for host, url, listname, destination in self.__next_downloads(hostqueues, hostactive, len(running)):
+                    running[executor.submit(self.__download_list, url, listname, destination)] = host
+
+                if len(running) == 0:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    hostactive[running.pop(future)] -= 1
+                    futures.append(future)
 
-        for blurl in customurllist:
-            i += 1
-            blname = f'bl_custom{i}'                       #Make up a name
-            print(f'{blname} - {blurl}')
+        failed = [future for future in futures if not future.result()]
+
+        print(f'Finished downloading block lists, {len(failed)} failed')
+        print()
+
+
+    def __get_listjobs(self):
+        """
+        Get the enabled default lists followed by users custom lists, in the order they must be merged
+
+        Returns:
+            List of tuples [blname, blfilename, bltype, source]
+        """
+        blfilename = ''                                    #Block list file name
+        jobs = list()
+
+        for blname, blconf in blocklistconf.items():
+            if not blconf[0]:                              #Skip disabled blocklist
+                continue
 
             #Is this a downloadable file or locally stored?
-            if blurl.startswith('http') or blurl.startswith('ftp'):
-                #Download to temp folder with loop position in file name
-                blfilename = f'{folders.tempdir}/{blname}.txt'
-                if self.__check_file_age(blfilename):      #Does file need freshening?
-                    self.__download_list(blurl, blname, blfilename)
+            if self.__is_downloadable(blconf[1]):
+                blfilename = f'{folders.tempdir}/{blname}.txt' #Downloaded to temp folder
+            else:                                          #Local file
+                blfilename = blconf[1]                     #URL is actually the filename
+
+            jobs.append(tuple([blname, blfilename, blconf[2], blname]))
 
+        for blname, blurl in self.__get_customlists():
+            if self.__is_downloadable(blurl):
+                #Downloaded to temp folder with loop position in file name
+                blfilename = f'{folders.tempdir}/{blname}.txt'
             else:                                          #Local file
-                blfilename = blurl;
+                blfilename = blurl
+
+            jobs.append(tuple([blname, blfilename, TYPE_CUSTOM, 'custom']))
+
+        return jobs
+
+
+    def __load_lists(self, jobs):
+        """
+        Generator which extracts domains from each list in jobs order
+        When more than one worker is set, lists are parsed concurrently in worker processes
+        No more than workers lists are parsed or waiting at a time, so memory use is bounded
+        Workers are started with forkserver (or spawn), as forking notrackd would copy its threads' locks
+
+        Parameters:
+            jobs (list): List of tuples [blname, blfilename, bltype, source]
+        Yields:
+            List of tuples [domain, comment] for each job
+        """
+        if self.__workers == 1 or len(jobs) < 2:
+            for blname, blfilename, bltype, source in jobs:
+                yield load_candidates(blname, blfilename, bltype)
+            return
+
+        print(f'Parsing {len(jobs)} block lists with {self.__workers} processes')
+        print()
+
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('forkserver')
+        else:
+            context = multiprocessing.get_context('spawn')
+
+        pending = deque()                                  #Futures in order of jobs
+        remaining = iter(jobs)
+
+        with ProcessPoolExecutor(max_workers=self.__workers, mp_context=context) as executor:
+            for blname, blfilename, bltype, source in islice(remaining, self.__workers):
+                pending.append(executor.submit(load_candidates, blname, blfilename, bltype))
+
+            while pending:
+                candidates = pending.popleft().result()
+                nextjob = next(remaining, None)
+                if nextjob is not None:                    #Replace the finished job
+                    pending.append(executor.submit(load_candidates, *nextjob[:3]))
+                yield candidates
+                candidates = None                          #Release list before waiting on the next
+
+
+    def __action_lists(self):
+        """
+        Go through config and process each enabled list, followed by users custom lists
+        1. Get lists to process in order (bl_tld must be early)
+        2. Extract domains from each list (or parsed cache), possibly in worker processes
+        3. Add domains to the blocklist in order of the lists
+        NOTE Downloading has already been carried out by __download_lists
+        """
+        jobs = list()
+
+        jobs = self.__get_listjobs()
+
+        if self.bl_custom == '':
+            print('No custom blocklists files or URLs set')
+            print()
+
+        for job, candidates in zip(jobs, self.__load_lists(jobs)):
+            blname, blfilename, bltype, source = job
+
+            print(f'Processing {blname}:')
 
-            filelines = load_file(blfilename)              #Read temp file
-            if not filelines:                              #Anything read from file?
+            if not candidates:                             #Anything read from file?
                 print(f'Data missing unable to process {blname}')
                 print()
                 continue
 
-            self.__process_customlist(filelines, blname)
+            self.__add_domains(candidates, source)
             print(f'Finished processing {blname}')
             print()
 
 
     def __dedup_lists(self):
         """
-        Final sort and then save list to file
-        1. Sort the blocklist by the reversed domain (blocklist[x][0])
-        2. Check if each item matches the beginning of the previous item
-            (i.e. a subdomain of a blocked domain)
-        3. Remove matched items from the list
-        4. Add unique items into sqldata and blacklist
-        5. Save blacklist to file
-        6. Insert SQL data
+        Final deduplication and then save list to file
+        1. Walk self.__blocklist checking if each item has a blocked parent domain
+            (i.e. a subdomain added before its parent domain was blocked)
+        2. Add unique items into self.__sqldata and blacklist
+        3. Save blacklist to file, if it has changed
+        4. Replace blocklist table with self.__sqldata (whitelist and blacklist)
         """
-        prev = '\0'                                        #Previous has to be something (e.g. a null byte)
         dns_blacklist = list()
-        sqldata = list()
 
         self.__dedupcount = 0
         print()
-        print('Sorting and Deduplicating blocklist')
+        print('Deduplicating blocklist')
 
-        self.__blocklist.sort(key=lambda x: x[0])          #Sort list on col0 "reversed"
-        for item in self.__blocklist:
-            if item[0].startswith(prev):
-                #print('Removing:', item)
-                #self.__blocklist.remove(item)
+        for domain, comment, source in self.__blocklist.items():
+            if self.__blocklist.find_parent(domain):
                 self.__dedupcount += 1
             else:
-                #self.__blocklist.append(tuple([reverse, subdomain, comment, source]))
-                dns_blacklist.append(self.__add_blacklist(item[1]))
-                sqldata.append(tuple([item[3], item[1], True, item[2]]))
-                prev = item[0]
+                dns_blacklist.append(self.__add_blacklist(domain))
+                self.__sqldata.append(tuple([source, domain, True, comment]))
 
         print(f'Further deduplicated {self.__dedupcount} domains')
         print(f'Final number of domains in blocklist: {len(dns_blacklist)}')
 
-        save_file(dns_blacklist, folders.dnslists + 'notrack.list')
-        self.__dbwrapper.blocklist_insertdata(sqldata)
+        self.__save_dnslist(dns_blacklist, folders.dnslists + 'notrack.list')
+        self.__dbwrapper.blocklist_replacedata(self.__sqldata)
+        self.__sqldata.clear()
 
 
     def create_blocklist(self):
         """
-        Create blocklist and restart DNS Server
+        Create blocklist and restart DNS Server if any lists have changed
         """
         print()
         self.__dbwrapper.blocklist_createtable()                      #Create SQL Tables
-        self.__dbwrapper.blocklist_cleartable()                       #Clear SQL Tables
 
+        self.__download_lists()                                       #Freshen old lists
         self.__process_whitelist()                                    #Need whitelist first
-        self.__action_lists()                                         #Action default lists
-        self.__action_customlists()                                   #Action users custom lists
+        self.__action_lists()                                         #Action default and custom lists
         self.__tld_whitelist()
 
         print('Finished processing all block lists')
@@ -679,7 +1074,11 @@ class BlockParser:
         print('Total number of domains deduplicated: %d' % self.__totaldedupcount)
 
         self.__dedup_lists()                                          #Dedup then insert domains
-        self.__services.restart_dnsserver()
+
+        if self.__dnslists_changed:                                   #Avoid dropping DNS cache
+            self.__services.restart_dnsserver()
+        else:
+            print('Block lists unchanged, no need to restart DNS server')
 
 
     def disable_blocking(self):
@@ -753,10 +1152,14 @@ class BlockParser:
 
 
 def main():
+    parser = argparse.ArgumentParser(description = 'NoTrack Block List Parser')
+    parser.add_argument('-w', '--workers', help='Number of processes to parse block lists with', type=int, default=1)
+    args = parser.parse_args()
+
     config = NoTrackConfig()
     check_root()
 
-    blockparser = BlockParser(config.dns_blockip)
+    blockparser = BlockParser(config.dns_blockip, args.workers)
     blockparser.load_blconfig()
     blockparser.create_blocklist()
 
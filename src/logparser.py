@@ -7,25 +7,191 @@
 #Usage : sudo python3 logparser.py
 
 #Standard imports
+from collections import namedtuple
 from datetime import date
+from functools import lru_cache, partial
+from hashlib import sha1
+from itertools import islice
+import json
 import os
-import re
 import sys
+import threading
 
 #Local imports
-from ntrkmariadb import DBWrapper
-from ntrkregex import Regex_Domain, Regex_TLD
+from lrucache import LRUCache
+from ntrkfilewatch import FileWatcher
+from ntrkmariadb import DBWrapper, INSERT_CHUNKSIZE
+from ntrkshared import save_file_atomic
+from ntrkspool import Spool
+from suffixindex import SuffixIndex
+
+#Constants
+QUICK_BLSOURCES_SIZE = 20000                               #Default number of domains held in quick lookup
+MAX_PENDING_QUERIES = 10000                                #Queries awaiting a reply carried between reads
+PARSE_BATCHSIZE = 50000                                    #Lines parsed and uploaded at a time by parsedns
+ROLLUP_HOURLY_DAYS = 90                                    #Days kept in dnslog_hourly table
+ROLLUP_DAILY_DAYS = 730                                    #Days kept in dnslog_daily table
+STREAM_BATCHSIZE = 5000                                    #Rows per dnslog insert when streaming
+STREAM_FLUSHTIME = 2.0                                     #Maximum seconds rows wait before insert when streaming
+
+
+@lru_cache(maxsize=256)
+def get_dnsmasqprefix(prefix):
+    """
+    Split and validate the date, time, and process of a dnsmasq line
+    Cached, as the prefix is the same for every line logged in the same second
+
+    Parameters:
+        prefix (str): Start of the line up to the process id e.g. Oct  8 10:00:00 dnsmasq[123
+    Returns:
+        Tuple of month (3 word chars), day (1-2 digits), time (hh:mm:ss)
+        None when prefix is invalid
+    """
+    fields = prefix.split(' ')
+    if len(fields) == 5 and fields[1] == '':               #Single digit day is padded with a space
+        del fields[1]
+
+    if len(fields) != 4:
+        return None
+
+    month, day, logtime, process = fields
+
+    chars = month.replace('_', '')
+    if not (len(month) == 3 and (chars == '' or chars.isalnum())):
+        return None
+
+    if not (len(day) <= 2 and day.isdecimal()):
+        return None
+
+    if not (len(logtime) == 8 and logtime[2] == ':' and logtime[5] == ':' and logtime[:2].isdecimal() and logtime[3:5].isdecimal() and logtime[6:].isdecimal()):
+        return None
+
+    if not (process[:8] == 'dnsmasq[' and len(process) <= 15 and process[8:].isdecimal()):
+        return None
+
+    return (month, day, logtime)
+
+
+@lru_cache(maxsize=1024)
+def is_dnsmasqip(ip):
+    """
+    Validate the client IP of a dnsmasq line (digits . :)
+    Cached, as there are usually few clients
+    """
+    chars = ip.replace('.', '').replace(':', '')
+    return ip != '' and (chars == '' or chars.isdecimal())
+
+
+@lru_cache(maxsize=8192)
+def is_dnsmasqdomain(domain):
+    """
+    Validate the domain of a dnsmasq line (2-254 word chars . -)
+    Cached, as popular domains are requested repeatedly
+    """
+    chars = domain.replace('.', '').replace('-', '').replace('_', '')
+    return 2 <= len(domain) <= 254 and (chars == '' or chars.isalnum())
+
+
+@lru_cache(maxsize=8192)
+def is_dnsmasqresult(res):
+    """
+    Validate the result of a dnsmasq line (word chars . : < >, can be empty)
+    Cached, as popular domains give the same result repeatedly
+    """
+    chars = res.replace('.', '').replace(':', '').replace('<', '').replace('>', '').replace('_', '')
+    return chars == '' or chars.isalnum()
+
+
+#Action field of wanted dnsmasq lines, including optional query type [A] to [AAAA]
+DNSMASQ_ACTIONS = {f'{action}{querytype}': action
+                   for action in ('query', 'reply', 'config', 'cached', '/etc/localhosts.list')
+                   for querytype in ('', '[A]', '[AA]', '[AAA]', '[AAAA]')}
+DNSMASQ_MIDDLEWORDS = frozenset(['is', 'to', 'from'])
+
+#Month field of dnsmasq lines (syslog always uses English month names)
+DNSMASQ_MONTHS = {'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+                  'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12}
+
+DnsmasqLine = namedtuple('DnsmasqLine', ['log_month', 'log_day', 'log_time', 'serial', 'sys', 'action', 'domain', 'res'])
+new_dnsmasqline = partial(tuple.__new__, DnsmasqLine)     #Create DnsmasqLine from a tuple without the slower __new__
+
+def tokenize_dnsmasqline(line):
+    """
+    Split a dnsmasq log line into its fields, without using a regex
+    Only query, reply, config, cached, and /etc/localhosts.list lines are accepted
+    e.g. Oct  8 10:00:00 dnsmasq[123]: 5 192.168.1.2/5000 query[A] site.com from 192.168.1.2
+
+    Fields are validated as strictly as the regex this replaced:
+    month (3 word chars), day (1-2 digits), time (hh:mm:ss), dnsmasq[pid], serial (digits),
+    ip/port (ip of digits . :), action with optional [A] to [AAAA], domain (2-254 word chars . -),
+    is / to / from, result (word chars . : < >, can be empty)
+    Word chars are letters, digits, and underscore
+
+    Parameters:
+        line (str): Line from dnslog file
+    Returns:
+        DnsmasqLine, or None when line is not wanted
+    """
+    pos = line.find(']: ')                                 #End of dnsmasq[pid]:
+    if pos == -1:
+        return None
+
+    fields = line[pos + 3:].split(' ')
+    if len(fields) != 6:
+        return None
+
+    #Reject by action first, as most unwanted lines are forwarded, validation, etc
+    action = DNSMASQ_ACTIONS.get(fields[2])
+    if action is None:
+        return None
+
+    serial, sysport, _, domain, middleword, res = fields
+
+    if middleword not in DNSMASQ_MIDDLEWORDS:
+        return None
+
+    if res[-1:] == '\n':                                   #Line end
+        res = res[:-1]
+
+    if not (is_dnsmasqdomain(domain) and is_dnsmasqresult(res)):
+        return None
+
+    ip, _, port = sysport.partition('/')
+    if not (port.isdecimal() and serial.isdecimal() and is_dnsmasqip(ip)):
+        return None
+
+    prefix = get_dnsmasqprefix(line[:pos])
+    if prefix is None:
+        return None
+
+    return new_dnsmasqline((*prefix, serial, ip, action, domain, res))
+
 
 class NoTrackParser():
-    def __init__(self):
+    def __init__(self, quicksize=QUICK_BLSOURCES_SIZE):
+        """
+        Parameters:
+            quicksize (int): Number of domains held in quick lookup of bl_source
+        """
         self.__DNSLOGFILE = '/var/log/notrack.log'
-        self.__blocklist_sources = dict()                  #Domains and bl_source from blocklist table
-        self.__quick_blsources = dict()                    #Quick lookup for domains and bl_source
+        self.__CURSORFILE = '/var/log/notrack.log.cursor'  #Position reached in dnslog file
+        self.__SPOOLFILE = '/var/log/notrack.spool'        #Queries waiting to be uploaded to dnslog table
+        self.__HEADSIZE = 256                              #Bytes used to fingerprint dnslog file
+        self.__cursor = self.__load_cursor()               #inode, offset, headsize, headhash
+        self.__blocklist_sources = SuffixIndex()           #Domains and bl_source from blocklist table
+        self.__quick_blsources = LRUCache(quicksize)       #Quick lookup for domains and bl_source
+        self.__tempqueries = dict()                        #Queries awaiting a reply, tracked by serial
         self.__dbwrapper = DBWrapper()                     #Declare MariaDB Wrapper
+        self.__spool = Spool(self.__SPOOLFILE)
 
-        self.__Regex_DnsmasqLine = re.compile(r'^(?P<log_month>\w{3})  ?(?P<log_day>\d{1,2}) (?P<log_time>\d{2}:\d{2}:\d{2}) dnsmasq\[\d{1,7}\]: (?P<serial>\d+) (?P<sys>[\d\.:]+)\/\d+ (?P<action>query|reply|config|cached|\/etc\/localhosts\.list)(?:\[A{1,4}\])? (?P<domain>[\w\.\-]{2,254}) (?:is|to|from) (?P<res>[\w\.:<>]*)$')
+        self.incognito = False                             #Streaming discards queries when set
+        self.__stream_drain = threading.Event()            #Wake stream writer before STREAM_FLUSHTIME
+        self.__stream_stop = threading.Event()             #Stop stream reader
+        self.__stream_done = threading.Event()             #Stop stream writer once reader has stopped
+        self.__stream_threads = []
 
         self.__dbwrapper.dnslog_createtable()              #Make sure dnslog table exists
+        self.__dbwrapper.rollup_createtable()              #Make sure dnslog rollup tables exist
 
 
     def blank_dnslog(self):
@@ -36,244 +202,500 @@ class NoTrackParser():
         try:
             f = open(self.__DNSLOGFILE, 'w')               #Open log file for ascii writing
         except IOError as e:
-            print(f'Unable to write to {self.__DNSLOGFILE}', file=sys.stder)
-            print(e, file=sys.stder)
+            print(f'Unable to write to {self.__DNSLOGFILE}', file=sys.stderr)
+            print(e, file=sys.stderr)
             return False
         except OSError as e:
-            print(f'Unable to write to {self.__DNSLOGFILE}', file=sys.stder)
-            print(e, file=sys.stder)
+            print(f'Unable to write to {self.__DNSLOGFILE}', file=sys.stderr)
+            print(e, file=sys.stderr)
             return False
         else:
             f.write('')                                    #Write blank
         finally:
             f.close()
+
+        self.__cursor = self.__new_cursor(self.__DNSLOGFILE)
+        self.__save_cursor()
         return True
 
 
-    def __load_dnslog(self):
+    def __get_headhash(self, filename, headsize):
         """
-        Load contents of file and return as a list
-        1. Check file exists
-        2. Read all lines of file
+        Fingerprint a file by hashing the first bytes of it
 
+        Parameters:
+            filename (str): File to fingerprint
+            headsize (int): Number of bytes to hash
         Returns:
-            List of all lines in file
-            Empty list if file doesn't exist or error occured
+            SHA1 hex digest
         """
-        print('Loading dnslog file')
-        if not os.path.isfile(self.__DNSLOGFILE):
-            print(f'Unable to load {self.__DNSLOGFILE}, file is missing', file=sys.stderr)
-            return []
+        with open(filename, 'rb') as f:
+            return sha1(f.read(headsize)).hexdigest()
+
+
+    def __new_cursor(self, filename, offset=0):
+        """
+        Create cursor for a file, identified by inode and fingerprint of the start of the file
 
+        Parameters:
+            filename (str): File
+            offset (int): Position in file
+        Returns:
+            Dictionary of inode, offset, headsize, headhash
+        """
+        headsize = min(self.__HEADSIZE, os.path.getsize(filename))
+
+        return {
+            'inode': os.stat(filename).st_ino,
+            'offset': offset,
+            'headsize': headsize,
+            'headhash': self.__get_headhash(filename, headsize),
+        }
+
+
+    def __load_cursor(self):
+        """
+        Load cursor from __CURSORFILE
+
+        Returns:
+            Dictionary of inode, offset, headsize, headhash
+            Cursor at start of file when __CURSORFILE is missing or invalid
+        """
         try:
-            f = open(self.__DNSLOGFILE, 'r')               #Open log file for reading
-        except IOError as e:
-            print(f'Unable to read to {self.__DNSLOGFILE}', file=sys.stder)
-            print(e, file=sys.stder)
-            return []
-        except OSError as e:
-            print(f'Unable to read to {self.__DNSLOGFILE}', file=sys.stder)
-            print(e, file=sys.stder)
-            return []
-        else:
-            filelines = f.readlines()
-        finally:
-            f.close()
+            with open(self.__CURSORFILE, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'inode': 0, 'offset': 0, 'headsize': 0, 'headhash': ''}
 
-        return filelines
+
+    def __save_cursor(self, cursor=None):
+        """
+        Save cursor to __CURSORFILE
+
+        Parameters:
+            cursor (dict): Copy of cursor to save, or None for the current cursor
+        """
+        save_file_atomic([json.dumps(cursor or self.__cursor)], self.__CURSORFILE)
+
+
+    def __is_cursorfile(self, filename):
+        """
+        Check if cursor belongs to filename by comparing the fingerprint of the file
+
+        Parameters:
+            filename (str): File
+        Returns:
+            True when file starts with the same bytes as when the cursor was made
+        """
+        headsize = self.__cursor['headsize']
+
+        if os.path.getsize(filename) < max(headsize, self.__cursor['offset']):
+            return False
+
+        return self.__get_headhash(filename, headsize) == self.__cursor['headhash']
+
+
+    def __read_from(self, filename, offset):
+        """
+        Generator of complete lines from offset in filename
+        An incomplete last line is left to be read next time
+        The cursor offset is moved after each line is read
+
+        Parameters:
+            filename (str): File
+            offset (int): Position in file
+        Yields:
+            Each complete line
+        """
+        with open(filename, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):               #Partial line, dnsmasq still writing
+                    break
+                self.__cursor['offset'] += len(line)
+                yield line.decode('utf-8', errors='replace')
+
+
+    def __read_dnslog(self):
+        """
+        Generator of new lines in dnslog file since the cursor
+        1. Check dnslog is the same file as the cursor (same inode and fingerprint)
+        2. If dnslog has been rotated with copytruncate, read the rest of the rotated copy
+        3. Read new lines from the cursor position
+
+        Yields:
+            Each new complete line
+        """
+        rotatedfile = f'{self.__DNSLOGFILE}.1'
+
+        if self.__cursor['inode'] == os.stat(self.__DNSLOGFILE).st_ino and self.__is_cursorfile(self.__DNSLOGFILE):
+            yield from self.__read_from(self.__DNSLOGFILE, self.__cursor['offset'])
+            return
+
+        print('dnslog file has been rotated or replaced')
+
+        #Copytruncate leaves the lines written before rotation in the rotated copy
+        if self.__cursor['offset'] > 0 and os.path.isfile(rotatedfile) and self.__is_cursorfile(rotatedfile):
+            print(f'Reading remainder of {rotatedfile}')
+            yield from self.__read_from(rotatedfile, self.__cursor['offset'])
+
+        self.__cursor = self.__new_cursor(self.__DNSLOGFILE)
+        yield from self.__read_from(self.__DNSLOGFILE, 0)
 
 
     def __process_dnslog(self, filelines):
         """
         In order to avoid repeat entries, log a query into tempqueries by its serial
         Once the result has been matched drop serial number from tempqueries
+        tempqueries is kept between reads, as a reply can arrive after the lines read so far
         log entries processed are stored in queries list
-        After processing upload queries into dnslog table
+
+        Parameters:
+            filelines (iterable): Lines from dnslog file
+        Returns:
+            List of queries to upload into dnslog table
         """
-        curyear = date.today().year                        #Current Year (Missing from dnsmasq)
-        curmonth = date.today().month                      #Current Month (Numeric value required)
+        today = date.today()                               #Year is missing from dnsmasq
         bl_source = ''                                     #Block List Source
         domain = ''
         serial = ''                                        #dnsmasq groups by a serial number
         sys = ''                                           #System (IP) which made the request
 
-        lineitem = []                                      #Named regex items from each line
+        lineitem = None                                    #DnsmasqLine fields from each line
         queries = []                                       #List of queries to upload
-        tempqueries = dict()                               #Tracking by serial
+        tempqueries = self.__tempqueries                   #Tracking by serial
 
         for line in filelines:
-            matches = self.__Regex_DnsmasqLine.match(line) #Only process certain entries
-            if matches is None:                            #Ignore 'forward' entries and any other system info from dnsmasq
+            lineitem = tokenize_dnsmasqline(line)          #Only process certain entries
+            if lineitem is None:                           #Ignore 'forward' entries and any other system info from dnsmasq
                 continue
 
-            lineitem = matches.groupdict()                 #Named regex items
-            domain = lineitem['domain']
-            serial = lineitem['serial']
-            sys = lineitem['sys']
+            domain = lineitem.domain
+            serial = lineitem.serial
+            sys = lineitem.sys
 
-            if lineitem['action'] != 'query':              #Beautify domains on a query response
+            if lineitem.action != 'query':                 #Beautify domains on a query response
                 if domain.startswith('www.'):
                     domain = domain.lstrip('www.')         #Remove preceding www.
 
-            if lineitem['action'] == 'query':              #Domain Query
-                log_date = self.__get_date(curyear, curmonth, lineitem['log_day'])
+            if lineitem.action == 'query':                 #Domain Query
+                log_date = self.__get_date(today, lineitem.log_month, lineitem.log_day)
+                if log_date is None:                       #Skip invalid date, the cursor still moves past it
+                    continue
                 #Query contains the fewest records, there so we calculate the ISO formatted date now
-                tempqueries[serial] = f"{log_date} {lineitem['log_time']}"
+                tempqueries[serial] = f"{log_date} {lineitem.log_time}"
 
-            elif lineitem['action'] == 'reply':            #Domain Allowed (new response)
+            elif lineitem.action == 'reply':               #Domain Allowed (new response)
                 if serial in tempqueries:
-                    if lineitem['res'] == '<CNAME>':       #CNAME results in another query against the serial number
+                    if lineitem.res == '<CNAME>':          #CNAME results in another query against the serial number
                         queries.append(tuple([tempqueries[serial], sys, domain, '1', 'cname']))
                     else:                                  #Answer found, drop the serial number
                         queries.append(tuple([tempqueries[serial], sys, domain, '1', 'allowed']))
                         tempqueries.pop(serial)
 
-            elif lineitem['action'] == 'cached':           #Domain Allowed (cached)
+            elif lineitem.action == 'cached':              #Domain Allowed (cached)
                 if serial in tempqueries:
-                    if lineitem['res'] == '<CNAME>':       #CNAME might not happen here
+                    if lineitem.res == '<CNAME>':          #CNAME might not happen here
                         queries.append(tuple([tempqueries[serial], sys, domain, '1', 'cname']))
                     else:                                  #Answer found, drop the serial number
                         queries.append(tuple([tempqueries[serial], sys, domain, '1', 'cached']))
                         tempqueries.pop(serial)
 
-            elif lineitem['action'] == 'config':           #Domain Blocked by NoTrack
+            elif lineitem.action == 'config':              #Domain Blocked by NoTrack
                 if serial in tempqueries:
                     #Find out which blocklist prevented the DNS lookup
                     bl_source = self.__get_blsource(domain)
                     queries.append(tuple([tempqueries[serial], sys, domain, '2', bl_source]))
                     tempqueries.pop(serial)
 
-            elif lineitem['action'] == '/etc/localhosts.list': #LAN Query
+            elif lineitem.action == '/etc/localhosts.list': #LAN Query
                 if serial in tempqueries:
                     queries.append(tuple([tempqueries[serial], sys, domain, '1', 'local']))
                     tempqueries.pop(serial)
 
-        if len(queries) == 0:                              #Anything processed?
-            print('Nothing in dnslog')
-            return
+        while len(tempqueries) > MAX_PENDING_QUERIES:      #Drop oldest queries which never got a reply
+            tempqueries.pop(next(iter(tempqueries)))
 
-        self.__dbwrapper.dnslog_insertdata(queries)        #Upload to dnslog table on MariaDB
+        return queries
 
 
     def __get_blsource(self, domain):
         """
         Returns the blocklist resposible for blocking a certain domain
+        The most specific blocked parent domain or TLD is found with one hash lookup per label
         Quick sources is provided as user may get repetitive subdomains being requested
 
         Parameters:
             domain (str): Domain Requested
 
         Returns:
-            List of all lines in file
-            Empty list if file doesn't exist
+            bl_source of the blocked domain
+            'invalid' when domain isn't in the blocklist
         """
-        if domain in self.__quick_blsources:               #Check quick list
-            return self.__quick_blsources[domain]
+        bl_source = self.__quick_blsources.get(domain)     #Check quick list
+        if bl_source is not None:
+            return bl_source
 
-        topdomain = ''                                     #site.com or site.co.uk
-        topdomain = self.__get_topdomain(domain)
+        bl_source = self.__blocklist_sources.find(domain, 'invalid')
+        self.__quick_blsources.put(domain, bl_source)
 
-        if topdomain in self.__blocklist_sources:          #Check topdomain in blocklist sources
-            self.__quick_blsources[domain] = self.__blocklist_sources[topdomain]
-            return self.__blocklist_sources[topdomain]
+        return bl_source
 
-        if domain in self.__blocklist_sources:             #Check domain in blocklist sources
-            self.__quick_blsources[domain] = self.__blocklist_sources[domain]
-            return self.__blocklist_sources[domain]
 
-        #At this point check TLD then subdomains will have to be reviewed in reverse order
-        checkstr = ''                                      #subdomain + topdomain
-        subdomainstr = ''                                  #growing subdomains string
-        subdomains = []                                    #subdomain1,subdomain2
-        tld = ''                                           #Top Level Domain
-
-        tld = self.__get_tld(domain)                       #Check against bl_tld
-        if tld in self.__blocklist_sources:
-            self.__quick_blsources[domain] = self.__blocklist_sources[tld]
-            return self.__blocklist_sources[tld]
+    def __get_date(self, today, log_month, log_day):
+        """
+        Get date formatted for MariaDB
+        A month later than the current month must be from last year e.g. Dec read in Jan
 
-        subdomains = self.__get_subdomains(domain, topdomain)
-        for i in range(len(subdomains) -1, 0, -1):         #Length of subdomains to zero
-            #Insert this subdomain at the begining, i.e read from right to left
-            subdomainstr = f'{subdomains[i]}.{subdomainstr}'
-            checkstr = f'{subdomainstr}{topdomain}'        #subdomain + topdomain
-            if checkstr in self.__blocklist_sources:       #Has subdomain + topdomain been found?
-                self.__quick_blsources[domain] = self.__blocklist_sources[checkstr]
-                return self.__blocklist_sources[checkstr]
+        Parameters:
+            today (date): Current date
+            log_month (str): Month name from dnsmasq line e.g. Oct
+            log_day (str): Day of month from dnsmasq line
+        Returns:
+            ISO formatted date
+            None when month or day is invalid
+        """
+        month = DNSMASQ_MONTHS.get(log_month)
+        if month is None:
+            return None
 
-        return 'invalid'                                   #Fallback response
+        year = today.year - 1 if month > today.month else today.year
 
+        try:
+            return date(year, month, int(log_day)).isoformat()
+        except ValueError:                                 #e.g. Feb 30
+            return None
 
 
-    def __get_date(self, curyear, curmonth, log_day):
+    def parsedns(self):
         """
-        Get date formatted for MariaDB
+        Parse new lines of the dnslog file into the spool
+        Lines are processed in batches of PARSE_BATCHSIZE, so memory stays bounded after a long outage
+        The cursor is saved once each batch of queries is safely in the spool
+        Use drain_spool to upload the queries into dnslog table
         """
-        return date(curyear, curmonth, int(log_day)).isoformat()
+        filelines = None
+        lines = []
+        queries = []
+        total = 0
+
+        if not os.path.isfile(self.__DNSLOGFILE):
+            print(f'Unable to load {self.__DNSLOGFILE}, file is missing', file=sys.stderr)
+            return
+
+        print('Loading new lines from dnslog file')
+        filelines = self.__read_dnslog()
 
+        while True:
+            lines = list(islice(filelines, PARSE_BATCHSIZE))
+            if len(lines) == 0:
+                break
 
-    def __get_subdomains(self, domain, topdomain):
+            queries = self.__process_dnslog(lines)
+            if not self.__spool_queries(queries):
+                return
+
+            total += len(queries)
+
+        if total == 0:                                     #Anything processed?
+            print('Nothing new in dnslog')
+
+        self.__update_headhash()                           #Cursor may have moved onto a new file
+        self.__save_cursor()
+
+
+    def __spool_queries(self, queries):
         """
-        Get the subdomains from a domain
+        Add queries to the spool, then save the cursor as the lines they came from are done with
 
         Parameters:
-            domain (str): Domain Requested
-            topdomain (str): site.com or site.co.uk from domain
+            queries (list): Queries from __process_dnslog
+        Returns:
+            True on success
+            False when spool can't be written, lines will be read again next time
+        """
+        if len(queries) > 0 and not self.__spool.append(queries):
+            print('Unable to save to spool, lines will be read again next time', file=sys.stderr)
+            self.__cursor = self.__load_cursor()
+            self.__tempqueries.clear()
+            return False
 
+        self.__update_headhash()
+        self.__save_cursor()
+        return True
+
+
+    def __drain_spool(self, dbwrapper):
+        """
+        Upload queries from the spool into dnslog table
+        Each chunk is committed in the spool once it has been inserted
+        Rows MariaDB rejects are skipped by dnslog_insertdata, so they can't hold up the spool
+
+        Parameters:
+            dbwrapper (DBWrapper): Connection to use
         Returns:
-            List subdomains if any subdomains have been requested
-            Or empty list for no subdomains
+            True when the spool is empty
+            False when MariaDB is unavailable, queries are kept for next time
         """
-        if domain == topdomain:                            #No subdomains
-            return []
+        while True:
+            rows, offset = self.__spool.read(INSERT_CHUNKSIZE)
+            if len(rows) == 0:
+                return True
 
-        subdomainstr = ''                                  #String of subdomains
-        subdomainstr = domain[:-(len(topdomain)+1)]        #Remove the topdomain
-        return subdomainstr.split('.')                     #Return list of subdomains split by '.'
+            if not dbwrapper.dnslog_insertdata(rows):      #Chunk is kept when MariaDB is unavailable
+                return False
 
+            self.__spool.commit(offset)
 
 
-    def __get_topdomain(self, domain):
+    def drain_spool(self):
+        """
+        Upload queries from the spool into dnslog table
+        Should not be called while streaming
         """
-        Get the top domain from a domain, i.e. site.com or site.co.uk
+        if not self.__drain_spool(self.__dbwrapper):
+            print('Unable to upload to dnslog, queries kept in spool for next time', file=sys.stderr)
 
-        Parameters:
-            domain (str): Domain Requested
 
+    def __update_headhash(self):
+        """
+        Update headhash, as the fingerprint grows with the file up to __HEADSIZE
+        """
+        if self.__cursor['headsize'] < self.__HEADSIZE:
+            self.__cursor.update(self.__new_cursor(self.__DNSLOGFILE, self.__cursor['offset']))
+
+
+    def __stream_read(self, spooled):
+        """
+        Read new lines from the dnslog file in batches and add them to the spool
+
+        Parameters:
+            spooled (int): Queries added since writer was woken
         Returns:
-            topdomain
+            Queries added since writer was woken
         """
-        matches = Regex_Domain.findall(domain)
-        if matches is None:                                #Shouldn't happen
-            return domain
-        else:
-            return matches[0][0] + matches[0][1]
+        if not os.path.isfile(self.__DNSLOGFILE):
+            return spooled
+
+        if self.incognito:                                 #No parsing with incognito
+            if os.path.getsize(self.__DNSLOGFILE) > 0:
+                self.blank_dnslog()
+                self.__tempqueries.clear()
+            return spooled
+
+        filelines = self.__read_dnslog()
+        while True:
+            lines = list(islice(filelines, STREAM_BATCHSIZE))
+            if len(lines) == 0:
+                break
+            queries = self.__process_dnslog(lines)
+            if not self.__spool_queries(queries):
+                break
+            spooled += len(queries)
+            if spooled >= STREAM_BATCHSIZE:
+                spooled = 0
+                self.__stream_drain.set()
+
+        return spooled
+
+
+    def __stream_reader(self):
+        """
+        Streaming thread which follows the dnslog file
+        New lines are processed in batches and added to the spool
+        The writer is woken once STREAM_BATCHSIZE queries are waiting
+        """
+        spooled = 0                                        #Queries added since writer was woken
+        stopping = False
+        watcher = FileWatcher(self.__DNSLOGFILE)
+
+        while not stopping:
+            stopping = self.__stream_stop.is_set()         #Last read of lines written before stop
+            try:
+                spooled = self.__stream_read(spooled)
+            except Exception as e:                         #Keep following the log, lines are read again from the cursor
+                print('Error reading dnslog file, trying again', file=sys.stderr)
+                print(e, file=sys.stderr)
+                self.__cursor = self.__load_cursor()       #Return to the last saved position
+                self.__tempqueries.clear()
+
+            if not stopping:
+                watcher.wait(STREAM_FLUSHTIME)
+
+        watcher.close()
 
 
-    def __get_tld(self, domain):
+    def __stream_writer(self):
         """
-        Get Top Level Domain
+        Streaming thread which uploads queries from the spool into dnslog table
+        Queries are uploaded once STREAM_BATCHSIZE are waiting or after STREAM_FLUSHTIME seconds
         """
-        matches = Regex_TLD.findall(domain)
-        if matches is None:
-            return domain
-        else:
-            return matches[0]
+        dbwrapper = None                                   #Connection can't be shared between threads
+        stopping = False
+
+        while not stopping:
+            stopping = self.__stream_done.is_set()         #Last upload of queries read before stop
+            if not stopping:
+                self.__stream_drain.wait(STREAM_FLUSHTIME)
+                self.__stream_drain.clear()
+
+            try:
+                if dbwrapper is None:
+                    dbwrapper = DBWrapper(dedicated=True)
+                self.__drain_spool(dbwrapper)
+            except Exception as e:                         #Queries stay in the spool, connect again next time
+                print('Error uploading to dnslog, trying again', file=sys.stderr)
+                print(e, file=sys.stderr)
+                dbwrapper = None
+
+
+    def start_streaming(self):
+        """
+        Start following the dnslog file, uploading new lines into dnslog table within seconds
+        parsedns, drain_spool, and blank_dnslog should not be called while streaming
+        """
+        if len(self.__stream_threads) > 0:
+            return
 
+        print('Streaming dnslog file into MariaDB')
+        self.__stream_stop.clear()
+        self.__stream_done.clear()
+        self.__stream_threads = [
+            threading.Thread(target=self.__stream_reader, name='dnslog-reader'),
+            threading.Thread(target=self.__stream_writer, name='dnslog-writer'),
+        ]
+        for thread in self.__stream_threads:
+            thread.start()
 
-    def parsedns(self):
+
+    def check_streaming(self):
         """
-        Parse the dnslog file into dnslog table on MariaDB
+        Restart any streaming thread which has stopped unexpectedly
         """
-        filelines = []
-        filelines = self.__load_dnslog()                   #Load dnslog file
+        targets = (self.__stream_reader, self.__stream_writer)
+
+        for i, thread in enumerate(self.__stream_threads):
+            if not thread.is_alive():
+                print(f'Streaming thread {thread.name} has stopped, restarting it', file=sys.stderr)
+                self.__stream_threads[i] = threading.Thread(target=targets[i], name=thread.name)
+                self.__stream_threads[i].start()
 
-        if len(filelines) < 4:                             #Minimum for processing
-            print('Nothing in dnslog, skipping')
+
+    def stop_streaming(self):
+        """
+        Stop streaming, uploading any queries which have been read
+        Queries which can't be uploaded stay in the spool for next time
+        """
+        if len(self.__stream_threads) == 0:
             return
 
-        self.blank_dnslog()                                #Empty log file to avoid repeat entries
-        self.__process_dnslog(filelines)                   #Process log file then upload to MariaDB
+        reader, writer = self.__stream_threads
+        self.__stream_stop.set()
+        reader.join()
+        self.__stream_done.set()
+        self.__stream_drain.set()
+        writer.join()
+        self.__stream_threads = []
 
 
     def readblocklist(self):
@@ -285,19 +707,56 @@ class NoTrackParser():
         print('Loading blocklist data from MariaDB into Log Parser')
         tabledata = self.__dbwrapper.blocklist_getdomains_listsource()
 
-        self.__blocklist_sources.clear()                   #Clear old data
-        self.__quick_blsources.clear()
-
+        #Build new lookup then swap it in, as the stream reader may be using the old one
+        blocklist_sources = SuffixIndex()
         for domain, bl_source in tabledata:
-            self.__blocklist_sources[domain] = bl_source
+            blocklist_sources.add(domain, bl_source)
+
+        quickstats = self.__quick_blsources.stats()
+        if quickstats['hits'] + quickstats['misses'] > 0:
+            print('Quick lookup hits: {hits}, misses: {misses}, evictions: {evictions}, size: {size}/{maxsize}'.format(**quickstats))
+
+        self.__blocklist_sources = blocklist_sources
+        self.__quick_blsources = LRUCache(self.__quick_blsources.maxsize)
 
         print(f'Number of domains in blocklist: {len(self.__blocklist_sources)}')
         print()
 
 
+    def get_quickstats(self):
+        """
+        Get hit, miss, and eviction counts of the quick bl_source lookup since blocklist was loaded
+
+        Returns:
+            Dictionary of size, maxsize, hits, misses, evictions
+        """
+        return self.__quick_blsources.stats()
+
+
+    def set_quicksize(self, quicksize):
+        """
+        Change number of domains held in quick lookup of bl_source
+        Least recently used domains are evicted next time a domain is added
+
+        Parameters:
+            quicksize (int): Number of domains
+        """
+        self.__quick_blsources.maxsize = quicksize
+
+
+    def partitionlogs(self):
+        """
+        Partition analytics and dnslog tables by day, creating partitions ahead of time
+        Run daily, so trimlogs can drop old partitions rather than delete rows
+        """
+        self.__dbwrapper.partition_table('analytics')
+        self.__dbwrapper.partition_table('dnslog')
+
+
     def trimlogs(self, days):
         """
         Trim rows older than a specified number of days from analytics and dnslog table
+        Rollup tables are trimmed separately, keeping at least as many days as dnslog
         Parameters:
             days (int): Interval of days to keep
                         When days is set to zero nothing will be deleted
@@ -305,6 +764,11 @@ class NoTrackParser():
         self.__dbwrapper.analytics_trim(days)
         self.__dbwrapper.dnslog_trim(days)
 
+        if days == 0:                                      #Keep rollups forever along with dnslog
+            self.__dbwrapper.rollup_trim(0, 0)
+        else:
+            self.__dbwrapper.rollup_trim(max(days, ROLLUP_HOURLY_DAYS), max(days, ROLLUP_DAILY_DAYS))
+
 
 def main():
     print('NoTrack Log Parser')
@@ -312,6 +776,7 @@ def main():
     ntrkparser = NoTrackParser()
     ntrkparser.readblocklist()
     ntrkparser.parsedns()
+    ntrkparser.drain_spool()
 
 
 if __name__ == "__main__":
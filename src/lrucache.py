@@ -0,0 +1,83 @@
+#NoTrack Least Recently Used Cache
+#Author: QuidsUp
+
+#Standard imports
+from collections import OrderedDict
+
+class LRUCache:
+    """
+    Dictionary limited to maxsize items, where the least recently used item is evicted first
+    Hits, misses, and evictions are counted to help choose a suitable maxsize
+    """
+    def __init__(self, maxsize):
+        """
+        Parameters:
+            maxsize (int): Maximum number of items held
+        """
+        self.__cache = OrderedDict()
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def __len__(self):
+        return len(self.__cache)
+
+
+    def clear(self):
+        """
+        Remove all items, counters are kept
+        """
+        self.__cache.clear()
+
+
+    def get(self, key, default=None):
+        """
+        Get value of key and mark it as most recently used
+
+        Parameters:
+            key: Key to look up
+            default: Value to return when key is missing
+        Returns:
+            Value of key or default
+        """
+        try:
+            value = self.__cache[key]
+        except KeyError:
+            self.misses += 1
+            return default
+
+        self.__cache.move_to_end(key)
+        self.hits += 1
+        return value
+
+
+    def put(self, key, value):
+        """
+        Add or replace key, evicting the least recently used item when full
+
+        Parameters:
+            key: Key to add
+            value: Value of key
+        """
+        self.__cache[key] = value
+        self.__cache.move_to_end(key)
+
+        while len(self.__cache) > self.maxsize:
+            self.__cache.popitem(last=False)
+            self.evictions += 1
+
+
+    def stats(self):
+        """
+        Returns:
+            Dictionary of size, maxsize, hits, misses, evictions
+        """
+        return {
+            'size': len(self.__cache),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
@@ -8,6 +8,7 @@
 
 #Standard imports
 from datetime import datetime
+import argparse
 import os
 import time
 import signal
@@ -28,11 +29,12 @@ runtime_blocklist = 0.0
 runtime_parser = 0.0
 runtime_trim = 0.0
 
+blocklist_workers = 1                                      #Processes to parse block lists with
 endloop = False
 
-ntrkparser = NoTrackParser()
-ntrkanalytics = NoTrackAnalytics()
-config = NoTrackConfig()
+ntrkparser = None                                          #Created in main() so block list
+ntrkanalytics = None                                       #worker processes can import this
+config = None                                              #module without side effects
 
 def blocklist_update():
     """
@@ -41,11 +43,12 @@ def blocklist_update():
     print()
     print('Updating Blocklist')
 
-    blockparser = BlockParser(config.dns_blockip)
+    blockparser = BlockParser(config.dns_blockip, blocklist_workers)
     blockparser.load_blconfig()
     blockparser.create_blocklist()                         #Create / Update Blocklists
     time.sleep(6)                                          #Prevent race condition
     ntrkparser.readblocklist()                             #Reload the blocklist on the log parser
+    ntrkanalytics.get_blocklists()                         #Reload the malware blocklists on analytics
     set_lastrun_times()
 
 
@@ -172,6 +175,8 @@ def logparser():
     else:
         ntrkparser.parsedns()
 
+    ntrkparser.drain_spool()                               #Upload queries parsed before any outage
+
 
 def check_config_files():
     """
@@ -210,8 +215,24 @@ def restart_dns():
 
 
 def main():
-    global endloop
+    global blocklist_workers, endloop
     global runtime_analytics, runtime_blocklist, runtime_parser, runtime_trim
+    global ntrkparser, ntrkanalytics, config
+
+    parser = argparse.ArgumentParser(description = 'NoTrack Daemon')
+    parser.add_argument('-s', '--stream', help='Stream dnslog into MariaDB continuously instead of every 4 minutes', action='store_true')
+    parser.add_argument('-c', '--cachesize', help='Number of domains held in blocklist source lookup cache', type=int)
+    parser.add_argument('-w', '--workers', help='Number of processes to parse block lists with', type=int, default=1)
+    args = parser.parse_args()
+
+    ntrkparser = NoTrackParser()
+    ntrkanalytics = NoTrackAnalytics()
+    config = NoTrackConfig()
+
+    if args.cachesize:
+        ntrkparser.set_quicksize(args.cachesize)
+
+    blocklist_workers = args.workers
 
     signal.signal(signal.SIGINT, exit_gracefully)  #2 Inturrupt
     signal.signal(signal.SIGABRT, exit_gracefully) #6 Abort
@@ -228,8 +249,13 @@ def main():
 
     #Initial setup
     ntrkparser.readblocklist()
+    ntrkparser.partitionlogs()
     set_lastrun_times()
 
+    if args.stream:
+        ntrkparser.incognito = bool(config.status & STATUS_INCOGNITO)
+        ntrkparser.start_streaming()
+
     while not endloop:
         current_time = time.time()
 
@@ -242,7 +268,10 @@ def main():
             runtime_analytics = current_time
             analytics()
 
-        if (runtime_parser + 240) <= current_time:
+        if args.stream:                                    #Stream reader handles the dnslog
+            ntrkparser.incognito = bool(config.status & STATUS_INCOGNITO)
+            ntrkparser.check_streaming()
+        elif (runtime_parser + 240) <= current_time:
             runtime_parser = current_time
             logparser()
 
@@ -252,10 +281,14 @@ def main():
 
         if (runtime_trim + 86400) <= current_time:
             runtime_trim = current_time                    #Reset runtime_trim
+            ntrkparser.partitionlogs()
             ntrkparser.trimlogs(config.dns_logretention)
 
         time.sleep(5)
 
+    if args.stream:
+        ntrkparser.stop_streaming()
+
 
 if __name__ == "__main__":
     main()
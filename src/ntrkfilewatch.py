@@ -0,0 +1,118 @@
+#NoTrack File Watcher
+#Author: QuidsUp
+
+#Standard imports
+import ctypes
+import ctypes.util
+import os
+import select
+import sys
+import time
+
+#Constants
+IN_MODIFY = 0x00000002                                     #File was modified
+IN_ATTRIB = 0x00000004                                     #Metadata changed (e.g. truncate)
+IN_MOVE_SELF = 0x00000800                                  #File was moved (rotated)
+IN_DELETE_SELF = 0x00000400                                #File was deleted (rotated)
+IN_NONBLOCK = 0x00000800                                   #Flag for inotify_init1
+IN_WATCHMASK = IN_MODIFY | IN_ATTRIB | IN_MOVE_SELF | IN_DELETE_SELF
+POLL_INTERVAL = 0.5                                        #Seconds between stat checks when inotify is unavailable
+
+class FileWatcher:
+    """
+    Wait for a file to be written to
+    Uses inotify when available, otherwise falls back to polling the file size
+    A rotated file is watched again once it has been replaced
+    """
+    def __init__(self, filename):
+        self.__filename = filename
+        self.__fd = -1                                     #inotify file descriptor
+        self.__wd = -1                                     #inotify watch descriptor
+        self.__libc = None
+        self.__laststat = None                             #Polling fallback (inode, size, mtime)
+
+        libcname = ctypes.util.find_library('c')
+        if libcname is not None:
+            try:
+                self.__libc = ctypes.CDLL(libcname, use_errno=True)
+                self.__fd = self.__libc.inotify_init1(IN_NONBLOCK)
+            except (OSError, AttributeError):
+                self.__fd = -1
+
+        if self.__fd < 0:
+            print('inotify unavailable, polling for file changes instead')
+
+        self.__add_watch()
+
+
+    def __add_watch(self):
+        """
+        Watch the current file, which may have been replaced since the last watch
+        """
+        if self.__fd < 0 or not os.path.isfile(self.__filename):
+            return
+
+        self.__wd = self.__libc.inotify_add_watch(self.__fd, os.fsencode(self.__filename), IN_WATCHMASK)
+
+
+    def __get_stat(self):
+        """
+        Polling fallback identifier of the file state
+        """
+        try:
+            st = os.stat(self.__filename)
+        except OSError:
+            return None
+
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+    def close(self):
+        """
+        Release inotify file descriptor
+        """
+        if self.__fd >= 0:
+            os.close(self.__fd)
+            self.__fd = -1
+
+
+    def wait(self, timeout):
+        """
+        Wait for the file to change
+
+        Parameters:
+            timeout (float): Maximum seconds to wait
+        Returns:
+            True when the file has changed, False on timeout
+        """
+        if self.__fd < 0:                                  #Polling fallback
+            endtime = time.monotonic() + timeout
+            while time.monotonic() < endtime:
+                currentstat = self.__get_stat()
+                if currentstat != self.__laststat:
+                    self.__laststat = currentstat
+                    return True
+                time.sleep(POLL_INTERVAL)
+            return False
+
+        if self.__wd < 0:                                  #File was missing, try again
+            self.__add_watch()
+            if self.__wd < 0:
+                time.sleep(timeout)
+                return False
+
+        readable, _, _ = select.select([self.__fd], [], [], timeout)
+        if not readable:
+            return False
+
+        events = os.read(self.__fd, 4096)                  #Drain events, only the change matters
+        pos = 0
+        while pos + 16 <= len(events):                     #struct inotify_event: wd, mask, cookie, len, name
+            mask = int.from_bytes(events[pos + 4:pos + 8], sys.byteorder)
+            if mask & (IN_MOVE_SELF | IN_DELETE_SELF):     #Rotated, watch the new file
+                self.__libc.inotify_rm_watch(self.__fd, self.__wd)
+                self.__wd = -1
+                self.__add_watch()
+            pos += 16 + int.from_bytes(events[pos + 12:pos + 16], sys.byteorder)
+
+        return True
@@ -8,7 +8,11 @@
 #TODO load unique password out of php file
 
 #Standard Imports
+from collections import Counter
+from datetime import date, datetime, timedelta
+from itertools import islice
 import logging
+import time
 
 #Additional standard import
 import mysql.connector as mariadb
@@ -20,26 +24,73 @@ from ntrkregex import *
 logger = logging.getLogger(__name__)
 #logger.setLevel(logging.INFO)
 
+#Constants
+INSERT_CHUNKSIZE = 10000                                   #Rows per multi-row INSERT
+UPDATE_CHUNKSIZE = 500                                     #Rows per CASE UPDATE, each row is a WHEN
+INSERT_RETRIES = 3                                         #Retries of a chunk after a transient error
+TRANSIENT_ERRORS = (1205, 1213, 2006, 2013)                #Lock wait timeout, deadlock, server gone, lost connection
+PARTITION_DAYSAHEAD = 7                                    #Daily partitions created ahead of time
+TRIM_CHUNKSIZE = 10000                                     #Rows per DELETE when trimming
+TO_DAYS_OFFSET = 365                                       #MariaDB TO_DAYS() is Python date.toordinal() + 365
+
+#Rollup tables of dnslog: table, period column, column type, SQL expression of period from log_time
+ROLLUPS = (
+    ('dnslog_hourly', 'log_hour', 'DATETIME', "DATE_FORMAT(log_time, '%Y-%m-%d %H:00:00')"),
+    ('dnslog_daily', 'log_day', 'DATE', 'DATE(log_time)'),
+)
+
+#Schema migrations of each table: version, description, SQL commands
+#Versions are recorded in schema_version table, and pending migrations are run in order by the createtable functions
+#Commands are safe to repeat, in case a migration was interrupted part way through
+SCHEMA_MIGRATIONS = {
+    'analytics': (
+        (1, 'VARCHAR columns, index log_time and dns_request', (
+            'UPDATE analytics SET sys = LEFT(sys, 45) WHERE CHAR_LENGTH(sys) > 45',
+            'ALTER TABLE analytics MODIFY sys VARCHAR(45), MODIFY dns_request VARCHAR(255), ADD INDEX IF NOT EXISTS log_time (log_time, ack), ADD INDEX IF NOT EXISTS dns_request (dns_request, issue)',
+        )),
+    ),
+    'blocklist': (
+        (1, 'VARCHAR columns, index site and bl_source', (
+            'UPDATE blocklist SET bl_source = LEFT(bl_source, 50) WHERE CHAR_LENGTH(bl_source) > 50',
+            'ALTER TABLE blocklist MODIFY bl_source VARCHAR(50), MODIFY site VARCHAR(255), ADD INDEX IF NOT EXISTS site (site), ADD INDEX IF NOT EXISTS bl_source (bl_source, site)',
+        )),
+    ),
+    'dnslog': (
+        (1, 'VARCHAR columns, index log_time and dns_request', (
+            'UPDATE dnslog SET sys = LEFT(sys, 45) WHERE CHAR_LENGTH(sys) > 45',
+            'ALTER TABLE dnslog MODIFY sys VARCHAR(45), MODIFY dns_request VARCHAR(255), ADD INDEX IF NOT EXISTS log_time (log_time, severity, bl_source), ADD INDEX IF NOT EXISTS dns_request (dns_request, log_time)',
+        )),
+    ),
+}
+
 class DBWrapper:
     """
     TODO load unique password out of php file
     """
-    def __init__(self):
+    def __init__(self, dedicated=False):
         """
         Create static value for DBWrapper and open connection to MariaDB
+        A dedicated connection is only used by this instance, which is required
+        when a DBWrapper is used from another thread
+
+        Parameters:
+            dedicated (bool): Open a connection for this instance only
         """
         ntrkuser = 'ntrk'
         ntrkpassword = 'ntrkpass'
         ntrkdb = 'ntrkdb'
 
-        DBWrapper.__db = mariadb.connect(user=ntrkuser, password=ntrkpassword, database=ntrkdb)
+        if dedicated:
+            self.__db = mariadb.connect(user=ntrkuser, password=ntrkpassword, database=ntrkdb)
+        else:                                              #Shared by all instances
+            DBWrapper.__db = mariadb.connect(user=ntrkuser, password=ntrkpassword, database=ntrkdb)
 
 
     #def __del__(self):
         """
         Close DB connector
         """
-        #DBWrapper.__db.close()
+        #self.__db.close()
 
 
     def __execute(self, cmd):
@@ -52,7 +103,7 @@ class DBWrapper:
             Success: Row Count
             Failure: False
         """
-        cursor = DBWrapper.__db.cursor()                   #Create a cursor
+        cursor = self.__db.cursor()                        #Create a cursor
         rowcount = 0                                       #Variable to hold rowcount
 
         try:
@@ -62,7 +113,7 @@ class DBWrapper:
             logger.warning(e)                              #Log the error message
             return False
         else:                                              #Successful execution
-            DBWrapper.__db.commit()
+            self.__db.commit()
             rowcount = cursor.rowcount                     #Get the rowcount
         finally:
             cursor.close()                                 #Close the cursor
@@ -79,7 +130,7 @@ class DBWrapper:
         """
         rowcount = 0
         tabledata = []                                     #Results from table
-        cursor = DBWrapper.__db.cursor()
+        cursor = self.__db.cursor()
 
         try:
             cursor.execute(search);
@@ -116,54 +167,185 @@ class DBWrapper:
         return coldata
 
 
+    def __get_schemaversion(self, table):
+        """
+        Get schema version of a table, creating schema_version table if it doesn't exist
+
+        Parameters:
+            table (str): Table name
+        Returns:
+            Schema version, zero for a table which has never been migrated
+        """
+        self.__execute('CREATE TABLE IF NOT EXISTS schema_version (table_name VARCHAR(64) NOT NULL PRIMARY KEY, version INT UNSIGNED NOT NULL, updated DATETIME NOT NULL)')
+
+        tabledata = self.__search(f"SELECT version FROM schema_version WHERE table_name = '{table}'")
+        if len(tabledata) == 0:
+            return 0
+
+        return tabledata[0][0]
+
+
+    def __migrate_table(self, table, created=False):
+        """
+        Run pending schema migrations of a table in order of version
+        A failed migration stops the upgrade, and is tried again next time
+
+        Parameters:
+            table (str): Table name
+            created (bool): Table has just been created with the original schema
+        Returns:
+            True: Table schema is up to date
+            False: Migration failed
+        """
+        version = self.__get_schemaversion(table)
+
+        if created and version > 0:                        #Table was deleted, so its version no longer applies
+            self.__execute(f"DELETE FROM schema_version WHERE table_name = '{table}'")
+            version = 0
+
+        for migration, description, commands in SCHEMA_MIGRATIONS[table]:
+            if migration <= version:
+                continue
+
+            print(f'Upgrading {table} table to schema version {migration}: {description}')
+            for cmd in commands:
+                if self.__execute(cmd) is False:
+                    logger.error(f'Unable to upgrade {table} table to schema version {migration}')
+                    return False
+
+            self.__execute(f"INSERT INTO schema_version (table_name, version, updated) VALUES ('{table}', {migration}, NOW()) ON DUPLICATE KEY UPDATE version = VALUES(version), updated = VALUES(updated)")
+
+        return True
+
+
     def analytics_createtable(self):
         """
-        Create SQL table for analytics, in case it has been deleted
+        Create SQL table for analytics, in case it has been deleted, and upgrade its schema
         """
-        cursor = DBWrapper.__db.cursor()
+        cursor = self.__db.cursor()
         cmd = 'CREATE TABLE IF NOT EXISTS analytics (id SERIAL, log_time DATETIME, sys TINYTEXT, dns_request TINYTEXT, severity CHAR(1), issue VARCHAR(50), ack BOOLEAN)';
 
         print('Checking SQL Table analytics exists')
+        created = len(self.__search("SHOW TABLES LIKE 'analytics'")) == 0
         cursor.execute(cmd);
         cursor.close()
 
+        #Last dnslog id checked by each analytics rule set
+        self.__execute('CREATE TABLE IF NOT EXISTS analytics_state (ruleset VARCHAR(50) NOT NULL PRIMARY KEY, last_id BIGINT UNSIGNED NOT NULL, updated DATETIME NOT NULL)')
+
+        self.__migrate_table('analytics', created)
 
-    def analytics_insertrecord(self, log_time, system, dns_request, severity, issue):
+
+    def analytics_getlastid(self, ruleset):
         """
-        Add a new record to analytics table
+        Get the last dnslog id checked by an analytics rule set
 
         Parameters:
-            recordnum (int): row id
-            log_time (str)
-            system (str)
-            dns_request
-            severity (char): '1', '2', '3'
-            issue (str)
+            ruleset (str): Name of rule set
         Returns:
-            True: Successful update
-            False: Invalid parameter or error occurred
+            Last dnslog id, or None when the rule set hasn't been run
         """
-        cmd = ''
-        cursor = DBWrapper.__db.cursor()
+        tabledata = self.__search(f"SELECT last_id FROM analytics_state WHERE ruleset = '{ruleset}'")
 
-        if severity not in ('1', '2', '3'):
-            logger.warning(f'Invalid severity {severity}')
-            return False
+        if len(tabledata) == 0:
+            return None
 
-        cmd = "INSERT INTO analytics (id,log_time,sys,dns_request,severity,issue,ack) VALUES (NULL,'%s','%s','%s','%s','%s',FALSE)" % (log_time, system, dns_request, severity, issue)
+        return tabledata[0][0]
 
-        try:
-            cursor.execute(cmd);
-        except mariadb.Error as e:
-            logger.warning('Unable to insert analytics record', exc_info=True)
+
+    def analytics_saveresults(self, updates, inserts, ruleset, lastid):
+        """
+        Save results of an analytics run in one transaction, along with the last dnslog id checked
+        dnslog rows are updated with a CASE UPDATE of up to UPDATE_CHUNKSIZE rows at a time,
+        limited to the range of log_time so only the relevant partitions are searched
+        Counts of the updated rows are moved to their new severity and bl_source in the rollup tables
+        analytics records are added with multi-row INSERTs
+
+        Parameters:
+            updates (list): Tuples of dnslog id, log_time, sys, dns_request, severity, bl_source,
+                            new severity, new bl_source
+            inserts (list): Tuples of log_time, sys, dns_request, severity, issue
+            ruleset (str): Name of rule set
+            lastid (int): Last dnslog id checked by the rule set
+        Returns:
+            True: Successful update
+            False: Invalid parameter or error occurred, nothing has been changed
+        """
+        statements = []
+
+        for recordnum, *_, severity, _ in updates:
+            if not isinstance(recordnum, int):             #Check record is an integer value
+                logger.warning(f'Invalid record number {recordnum}')
+                return False
+            if severity not in ('1', '2', '3'):
+                logger.warning(f'Invalid severity {severity}')
+                return False
+
+        for row in inserts:
+            if row[3] not in ('1', '2', '3'):
+                logger.warning(f'Invalid severity {row[3]}')
+                return False
+
+        for i in range(0, len(updates), UPDATE_CHUNKSIZE):
+            chunk = updates[i:i+UPDATE_CHUNKSIZE]
+            whens = ' '.join(['WHEN %s THEN %s'] * len(chunk))
+            ids = ', '.join(['%s'] * len(chunk))
+            cmd = f'UPDATE dnslog SET severity = CASE id {whens} END, bl_source = CASE id {whens} END WHERE id IN ({ids}) AND log_time BETWEEN %s AND %s'
+            params = [value for recordnum, *_, severity, _ in chunk for value in (recordnum, severity)]
+            params += [value for recordnum, *_, bl_source in chunk for value in (recordnum, bl_source)]
+            params += [row[0] for row in chunk]
+            params += [min(row[1] for row in chunk), max(row[1] for row in chunk)]
+            statements.append((cmd, [tuple(params)]))
+
+        if len(updates) > 0:
+            statements += self.__rollup_statements(updates)
+
+        if len(inserts) > 0:
+            #executemany rewrites an INSERT into a single multi-row INSERT
+            statements.append(('INSERT INTO analytics (id, log_time, sys, dns_request, severity, issue, ack) VALUES (NULL, %s, %s, %s, %s, %s, FALSE)', inserts))
+
+        statements.append(('INSERT INTO analytics_state (ruleset, last_id, updated) VALUES (%s, %s, NOW()) ON DUPLICATE KEY UPDATE last_id = VALUES(last_id), updated = VALUES(updated)', [(ruleset, lastid)]))
+
+        if not self.__execute_transaction(statements):
+            logger.warning('Unable to save analytics results')
             return False
-        finally:
-            DBWrapper.__db.commit()
-            cursor.close()
 
+        logger.info(f'Updated {len(updates)} dnslog records and added {len(inserts)} analytics records')
         return True
 
 
+    def __rollup_statements(self, updates):
+        """
+        Statements to move counts of updated dnslog rows in the rollup tables
+        from their old severity and bl_source to the new ones, so the rollups match dnslog
+        Rows are counted here by hour and day, so each rollup row is only changed once
+
+        Parameters:
+            updates (list): Tuples of dnslog id, log_time, sys, dns_request, severity, bl_source,
+                            new severity, new bl_source
+        Returns:
+            List of tuples of SQL command and rows
+        """
+        added = (Counter(), Counter())                     #Hourly and daily
+        removed = (Counter(), Counter())
+        statements = []
+
+        for _, log_time, sys, dns_request, severity, bl_source, new_severity, new_bl_source in updates:
+            log_time = str(log_time)                       #Same format as inserted rows
+            sys = sys[:45]                                 #Longest IPv6 address
+            for i, period in enumerate((f'{log_time[:13]}:00:00', log_time[:10])):
+                removed[i][(period, sys, dns_request, severity, bl_source or '')] += 1
+                added[i][(period, sys, dns_request, new_severity, new_bl_source)] += 1
+
+        for (table, period, _, _), removecounts, addcounts in zip(ROLLUPS, removed, added):
+            periods = [key[0] for key in removecounts]
+            statements.append((f'UPDATE {table} SET queries = queries - LEAST(queries, %s) WHERE {period} = %s AND sys = %s AND dns_request = %s AND severity = %s AND bl_source = %s', [(count, *key) for key, count in removecounts.items()]))
+            statements.append((f'INSERT INTO {table} ({period}, sys, dns_request, severity, bl_source, queries) VALUES (%s, %s, %s, %s, %s, %s) ON DUPLICATE KEY UPDATE queries = queries + VALUES(queries)', [(*key, count) for key, count in addcounts.items()]))
+            statements.append((f'DELETE FROM {table} WHERE {period} BETWEEN %s AND %s AND queries = 0', [(min(periods), max(periods))]))
+
+        return statements
+
+
     def analytics_trim(self, days):
         """
         Trim rows older than a specified number of days from analytics table
@@ -182,7 +364,7 @@ class DBWrapper:
             logger.info('Days set to zero, keeping logs forever')
             return True
 
-        res = self.__execute(f"DELETE FROM analytics WHERE log_time < NOW() - INTERVAL '{days}' DAY")
+        res = self.__trim_table('analytics', days)
 
         if res != False:
             print(f'Trimmed {res} rows from analytics table')
@@ -192,26 +374,18 @@ class DBWrapper:
 
     def blocklist_createtable(self):
         """
-        Create SQL table for blocklist, in case it has been deleted
+        Create SQL table for blocklist, in case it has been deleted, and upgrade its schema
         """
-        cursor = DBWrapper.__db.cursor()
+        cursor = self.__db.cursor()
 
         cmd = 'CREATE TABLE IF NOT EXISTS blocklist (id SERIAL, bl_source TINYTEXT, site TINYTEXT, site_status BOOLEAN, comment TEXT)';
 
         print('Checking SQL Table for blocklist exists')
+        created = len(self.__search("SHOW TABLES LIKE 'blocklist'")) == 0
         cursor.execute(cmd);
         cursor.close()
 
-
-    def blocklist_cleartable(self):
-        """
-        Clear blocklist table and reset serial increment
-        """
-        cursor = DBWrapper.__db.cursor()
-
-        cursor.execute('DELETE FROM blocklist')
-        cursor.execute('ALTER TABLE blocklist AUTO_INCREMENT = 1')
-        cursor.close()
+        self.__migrate_table('blocklist', created)
 
 
     def blocklist_getactive(self):
@@ -249,6 +423,24 @@ class DBWrapper:
         return tabledata
 
 
+    def blocklist_getdomains_sources(self, sources):
+        """
+        Get Domains and List source of specific blocklists
+
+        Parameters:
+            sources (list): Blocklist names
+        Returns:
+            List of tuples of site, bl_source
+        """
+        cmd = ''
+        tabledata = []
+
+        cmd = "SELECT site,bl_source FROM blocklist WHERE bl_source IN ('%s')" % "','".join(sources)
+        tabledata = self.__search(cmd)
+
+        return tabledata
+
+
     def blocklist_getwhitelist(self):
         """
         Get list of whitelisted domains
@@ -272,22 +464,79 @@ class DBWrapper:
 
 
 
-    def blocklist_insertdata(self, sqldata):
+    def __get_indexes(self, table):
         """
-        Bulk insert a list into MariaDB
-        NOTE Single quotes aren't needed around %s as they're added by executemany function
+        Get definitions of secondary indexes on a table, excluding the primary key and id
 
         Parameters:
-            sqldata (list): List of data
+            table (str): Table name
+        Returns:
+            Dictionary of index name: [unique (bool), list of columns]
         """
-        cmd = ''
-        cursor = DBWrapper.__db.cursor()
+        indexes = dict()
 
-        cmd = 'INSERT INTO blocklist (id, bl_source, site, site_status, comment) VALUES (NULL, %s, %s, %s, %s)'
+        #Columns: 0 Table, 1 Non_unique, 2 Key_name, 3 Seq_in_index, 4 Column_name, 5 Collation, 6 Cardinality, 7 Sub_part
+        for row in self.__search(f'SHOW INDEX FROM {table}'):
+            if row[2] == 'PRIMARY' or row[2] == 'id':
+                continue
+            column = row[4] if row[7] is None else f'{row[4]}({row[7]})'
+            indexes.setdefault(row[2], tuple([row[1] == 0, list()]))[1].append(column)
 
-        cursor.executemany(cmd, sqldata)
-        DBWrapper.__db.commit()
-        cursor.close()
+        return indexes
+
+
+    def blocklist_replacedata(self, sqldata):
+        """
+        Replace contents of blocklist table without readers seeing an empty or partial table
+        1. Create blocklist_new staging table like blocklist, without its secondary indexes
+        2. Insert sqldata into staging table in chunks of multi-row INSERTs
+        3. Build the secondary indexes on the staging table
+        4. Atomically swap the tables with RENAME TABLE, then drop the old table
+
+        Parameters:
+            sqldata (list): List of tuples [bl_source, site, site_status, comment]
+        Returns:
+            True on success
+            False on failure, in which case blocklist table is left untouched
+        """
+        cmd = 'INSERT INTO blocklist_new (id, bl_source, site, site_status, comment) VALUES (NULL, %s, %s, %s, %s)'
+        cursor = self.__db.cursor()
+        indexes = dict()
+
+        print(f'Loading {len(sqldata)} rows into blocklist table')
+
+        try:
+            cursor.execute('DROP TABLE IF EXISTS blocklist_new')
+            cursor.execute('CREATE TABLE blocklist_new LIKE blocklist')
+
+            indexes = self.__get_indexes('blocklist_new')
+            if len(indexes) > 0:                           #Quicker to build indexes after loading
+                cursor.execute('ALTER TABLE blocklist_new ' + ', '.join(f'DROP INDEX {name}' for name in indexes))
+
+            for i in range(0, len(sqldata), INSERT_CHUNKSIZE):
+                #executemany rewrites an INSERT into a single multi-row INSERT
+                cursor.executemany(cmd, sqldata[i:i+INSERT_CHUNKSIZE])
+                self.__db.commit()
+
+            if len(indexes) > 0:
+                addindexes = list()
+                for name, (unique, columns) in indexes.items():
+                    addindexes.append(f"ADD {'UNIQUE ' if unique else ''}INDEX {name} ({', '.join(columns)})")
+                cursor.execute('ALTER TABLE blocklist_new ' + ', '.join(addindexes))
+
+            cursor.execute('DROP TABLE IF EXISTS blocklist_old')
+            cursor.execute('RENAME TABLE blocklist TO blocklist_old, blocklist_new TO blocklist')
+            cursor.execute('DROP TABLE blocklist_old')
+        except mariadb.Error as e:
+            logger.warning('Unable to replace blocklist table data, keeping existing data')
+            logger.warning(e)
+            self.__db.rollback()
+            self.__execute('DROP TABLE IF EXISTS blocklist_new')
+            return False
+        finally:
+            cursor.close()
+
+        return True
 
 
     def blocklist_search(self, s):
@@ -346,64 +595,238 @@ class DBWrapper:
     #DNS Log Table
     def dnslog_createtable(self):
         """
-        Create SQL table for dnslog, in case it has been deleted
+        Create SQL table for dnslog, in case it has been deleted, and upgrade its schema
         """
-        cursor = DBWrapper.__db.cursor()
+        cursor = self.__db.cursor()
 
         cmd = 'CREATE TABLE IF NOT EXISTS dnslog (id SERIAL, log_time DATETIME, sys TINYTEXT, dns_request TINYTEXT, severity CHAR(1), bl_source VARCHAR(50))';
 
         print('Checking SQL Table dnslog exists')
+        created = len(self.__search("SHOW TABLES LIKE 'dnslog'")) == 0
         cursor.execute(cmd);
         cursor.close()
 
+        self.__migrate_table('dnslog', created)
 
-    def dnslog_insertdata(self, sqldata):
+
+    def __is_transient(self, e):
         """
-        Bulk insert a list into dnslog
-        NOTE Single quotes aren't needed around %s as they're added by executemany function
+        Check if a MariaDB error is worth retrying, e.g. deadlock or lost connection
 
         Parameters:
-            sqldata (list): List of data
+            e (mariadb.Error): Error raised
+        Returns:
+            True when the same statement might succeed if retried
         """
-        cmd = ''
-        cursor = DBWrapper.__db.cursor()
+        if isinstance(e, (mariadb.OperationalError, mariadb.InterfaceError)):
+            return True
 
-        cmd = 'INSERT INTO dnslog (id, log_time, sys, dns_request, severity, bl_source) VALUES (NULL, %s, %s, %s, %s, %s)'
+        return e.errno in TRANSIENT_ERRORS
 
-        cursor.executemany(cmd, sqldata)
-        DBWrapper.__db.commit()
-        print(f'Added {cursor.rowcount} rows to dnslog table')
-        cursor.close()
 
+    def __execute_transaction(self, statements):
+        """
+        Execute bulk statements together in one transaction
+        Transient errors are retried with an increasing delay, reconnecting if necessary
 
-    def dnslog_searchmalware(self, bl):
+        Parameters:
+            statements (list): Tuples of SQL command and list of rows for executemany
+        Returns:
+            True: Successful transaction
+            False: Transient error persisted, nothing has been changed
+            None: Error which retrying won't fix e.g. data too long, nothing has been changed
+        """
+        for attempt in range(INSERT_RETRIES + 1):
+            try:
+                cursor = self.__db.cursor()
+                try:
+                    for cmd, rows in statements:
+                        cursor.executemany(cmd, rows)
+                    self.__db.commit()
+                finally:
+                    cursor.close()
+            except mariadb.Error as e:
+                try:
+                    self.__db.rollback()
+                except mariadb.Error:
+                    pass                                   #Connection lost, nothing to roll back
+
+                if not self.__is_transient(e):
+                    logger.warning(f'Unable to execute transaction of {len(statements)} statements')
+                    logger.warning(e)
+                    return None
+
+                if attempt == INSERT_RETRIES:
+                    logger.warning(f'Unable to execute transaction of {len(statements)} statements')
+                    logger.warning(e)
+                    return False
+
+                logger.info(f'Retrying transaction after error: {e}')
+                time.sleep(2 ** attempt)
+                try:
+                    self.__db.ping(reconnect=True, attempts=1, delay=0)
+                except mariadb.Error:
+                    pass                                   #Next attempt will fail if still unavailable
+            else:
+                return True
+
+
+    def __dnslog_statements(self, chunk):
         """
-        Get past hour of results from dnslog looking for results from a blocklist
+        Statements to insert a chunk of rows into dnslog and add them to the rollup tables
+        Rows are counted here by hour and day, so each rollup row is only upserted once per chunk
 
         Parameters:
-        bl (str): Enabled blocklist to search from
+            chunk (list): Rows of log_time, sys, dns_request, severity, bl_source
+        Returns:
+            List of tuples of SQL command and rows
         """
-        cmd = ''
-        tabledata = []
+        hourly = Counter()
+        daily = Counter()
+        rows = []
 
-        cmd = f"SELECT * FROM dnslog WHERE log_time >= DATE_SUB(NOW(), INTERVAL 1 HOUR) AND dns_request IN (SELECT site FROM blocklist WHERE bl_source = '{bl}') GROUP BY(dns_request) AND severity = 1 AND bl_source IN ('allowed', 'cname') ORDER BY id asc"
+        for log_time, sys, dns_request, severity, bl_source in chunk:
+            sys = sys[:45]                                 #Longest IPv6 address
+            rows.append((log_time, sys, dns_request, severity, bl_source))
+            hourly[(f'{log_time[:13]}:00:00', sys, dns_request, severity, bl_source)] += 1
+            daily[(log_time[:10], sys, dns_request, severity, bl_source)] += 1
 
-        tabledata = self.__search(cmd)
+        statements = [('INSERT INTO dnslog (id, log_time, sys, dns_request, severity, bl_source) VALUES (NULL, %s, %s, %s, %s, %s)', rows)]
 
-        return(tabledata)
+        for (table, period, _, _), counts in zip(ROLLUPS, (hourly, daily)):
+            cmd = f'INSERT INTO {table} ({period}, sys, dns_request, severity, bl_source, queries) VALUES (%s, %s, %s, %s, %s, %s) ON DUPLICATE KEY UPDATE queries = queries + VALUES(queries)'
+            statements.append((cmd, [(*key, count) for key, count in counts.items()]))
+
+        return statements
+
+
+    def __insert_rowbyrow(self, chunk):
+        """
+        Insert a chunk into dnslog one row at a time in one transaction, skipping rows MariaDB rejects
+        Used when a chunk fails with an error retrying won't fix, e.g. incorrect string value
+        Each row is inserted after a savepoint, so a rejected row is rolled back on its own
+
+        Parameters:
+            chunk (list): Rows of log_time, sys, dns_request, severity, bl_source
+        Returns:
+            Number of rows skipped
+            None: Error occurred, nothing has been changed
+        """
+        skipped = 0
+        cursor = self.__db.cursor()
+
+        try:
+            for row in chunk:
+                cursor.execute('SAVEPOINT dnslog_row')
+                try:
+                    for cmd, rows in self.__dnslog_statements([row]):
+                        cursor.executemany(cmd, rows)
+                except mariadb.Error as e:
+                    if self.__is_transient(e):
+                        raise
+                    cursor.execute('ROLLBACK TO SAVEPOINT dnslog_row')
+                    logger.warning(f'Skipping row rejected by dnslog table: {row}')
+                    logger.warning(e)
+                    skipped += 1
+            self.__db.commit()
+        except mariadb.Error as e:
+            try:
+                self.__db.rollback()
+            except mariadb.Error:
+                pass                                       #Connection lost, nothing to roll back
+            logger.warning('Unable to insert rows into dnslog one at a time')
+            logger.warning(e)
+            return None
+        finally:
+            cursor.close()
+
+        return skipped
+
+
+    def dnslog_insertdata(self, sqldata):
+        """
+        Bulk insert into dnslog in chunks of INSERT_CHUNKSIZE rows, each in its own transaction
+        Rollup tables are updated in the same transaction
+        Up to INSERT_CHUNKSIZE rows are inserted all or nothing
+        A chunk MariaDB rejects is inserted row by row, skipping the bad rows, so it can't block later rows
+        NOTE Single quotes aren't needed around %s as they're added by executemany function
+
+        Parameters:
+            sqldata (iterable): Rows of log_time, sys, dns_request, severity, bl_source
+        Returns:
+            True: All rows inserted or skipped
+            False: Error occurred, rows from the failed chunk onwards have not been added
+        """
+        inserted = 0
+        result = None
+        rows = iter(sqldata)
+        skipped = 0
+
+        while True:
+            chunk = list(islice(rows, INSERT_CHUNKSIZE))
+            if len(chunk) == 0:
+                break
+
+            result = self.__execute_transaction(self.__dnslog_statements(chunk))
+            if result is None:                             #Chunk contains a row MariaDB rejects
+                skipped = self.__insert_rowbyrow(chunk)
+                if skipped is None:
+                    result = False
+                else:
+                    inserted -= skipped
+                    result = True
+
+            if not result:
+                print(f'Added {inserted} rows to dnslog table')
+                return False
+
+            inserted += len(chunk)
+
+        print(f'Added {inserted} rows to dnslog table')
+        return True
 
 
-    def dnslog_searchregex(self, pattern):
+    def dnslog_getmaxid(self):
         """
-        Get past hour of results from dnslog based on a regex pattern
+        Get the newest id in dnslog
+
+        Returns:
+            Newest id, or None when dnslog is empty
+        """
+        tabledata = self.__search('SELECT MAX(id) FROM dnslog')
+
+        if len(tabledata) == 0:
+            return None
+
+        return tabledata[0][0]
+
+
+    def dnslog_searchnew(self, lastid, maxid, blocked=False):
+        """
+        Get allowed results from dnslog added since an analytics rule set was last run
+        The primary key range is searched, so each row is only checked once however often analytics is run
 
         Parameters:
-            pattern (str): Regex pattern to search
+            lastid (int): Last id checked, or None to check the past hour
+            maxid (int): Newest id to check
+            blocked (bool): Include blocked results too
+        Returns:
+            List of rows in order of id
         """
         cmd = ''
+        results = "severity = '1' AND bl_source IN ('allowed', 'cname')"
         tabledata = []
 
-        cmd = f"SELECT * FROM dnslog WHERE log_time >= DATE_SUB(NOW(), INTERVAL 1 HOUR) AND dns_request REGEXP '{pattern}' AND severity = '1' AND bl_source IN ('allowed', 'cname') ORDER BY id asc"
+        if lastid == maxid:                                #No new rows
+            return []
+
+        if blocked:
+            results = f"(({results}) OR severity = '2')"
+
+        if lastid is None:
+            cmd = f"SELECT * FROM dnslog WHERE log_time >= DATE_SUB(NOW(), INTERVAL 1 HOUR) AND id <= {maxid} AND {results} ORDER BY id asc"
+        else:
+            cmd = f"SELECT * FROM dnslog WHERE id > {lastid} AND id <= {maxid} AND {results} ORDER BY id asc"
 
         tabledata = self.__search(cmd)
 
@@ -428,7 +851,7 @@ class DBWrapper:
             logger.info('Days set to zero, keeping logs forever')
             return True
 
-        res = self.__execute(f"DELETE FROM dnslog WHERE log_time < NOW() - INTERVAL '{days}' DAY")
+        res = self.__trim_table('dnslog', days)
 
         if res != False:
             print(f'Trimmed {res} rows from dnslog table')
@@ -436,38 +859,171 @@ class DBWrapper:
         return res
 
 
-    def dnslog_updaterecord(self, recordnum, severity, bl_source):
+    def __get_partitions(self, table):
         """
-        Update the dns_result value in dnslog table
+        Get partitions of a table
 
         Parameters:
-            recordnum (int): row id
-            dns_result: New value for dns_result (M, T)
+            table (str): Table name
         Returns:
-            True: Successful update
-            False: Invalid parameter or error occurred
+            Dictionary of partition name: upper bound as TO_DAYS value, or None for MAXVALUE
+            Empty dictionary when table isn't partitioned
         """
-        cmd = ''
-        cursor = DBWrapper.__db.cursor()
+        partitions = dict()
 
-        if not isinstance(recordnum, int):                #Check record is an integer value
-            print('Invalid record number')
-            return False
+        for name, description in self.__search(f"SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = '{table}' AND PARTITION_NAME IS NOT NULL ORDER BY PARTITION_ORDINAL_POSITION"):
+            partitions[name] = None if description == 'MAXVALUE' else int(description)
 
-        if severity not in ('1', '2', '3'):
-            print(f'Invalid Severity {severity}')
-            return False
+        return partitions
 
-        cmd = f"UPDATE dnslog SET severity='{severity}', bl_source = '{bl_source}' WHERE id={recordnum}"
 
-        try:
-            cursor.execute(cmd);
-        except mariadb.Error as e:
-            print('Unable to update dnslog record :-( {}'.format(e))
-            return False
-        finally:
-            DBWrapper.__db.commit()
-            cursor.close()
+    def __partition_definitions(self, firstday, lastday):
+        """
+        Definitions of a daily partition for each day from firstday to lastday, followed by pfuture
+        Partitions are named by the day they hold, e.g. p20201018
+
+        Parameters:
+            firstday (date): First day
+            lastday (date): Last day
+        Returns:
+            Comma separated partition definitions
+        """
+        definitions = []
+        day = firstday
+
+        while day <= lastday:
+            definitions.append(f'PARTITION p{day:%Y%m%d} VALUES LESS THAN ({day.toordinal() + 1 + TO_DAYS_OFFSET})')
+            day += timedelta(days=1)
+
+        definitions.append('PARTITION pfuture VALUES LESS THAN MAXVALUE')
+        return ', '.join(definitions)
+
+
+    def __trim_table(self, table, days):
+        """
+        Trim rows older than a specified number of days from a table
+        1. Drop daily partitions which only hold rows older than days
+        2. Delete any remaining older rows in chunks of TRIM_CHUNKSIZE, so locks are held briefly
+        Without partitions only the chunked delete is used
+
+        Parameters:
+            table (str): Table name
+            days (int): Interval of days to keep
+        Returns:
+            Success: Number of rows deleted, excluding rows in dropped partitions
+            Failure: False
+        """
+        cutoff = (datetime.now() - timedelta(days=days)).date().toordinal() + TO_DAYS_OFFSET
+        deleted = 0
+        dropnames = []
+        res = 0
+
+        for name, bound in self.__get_partitions(table).items():
+            if bound is not None and bound <= cutoff:      #Newest row in partition is older than cutoff
+                dropnames.append(name)
+
+        if len(dropnames) > 0:
+            if self.__execute(f"ALTER TABLE {table} DROP PARTITION {', '.join(dropnames)}") is not False:
+                print(f"Dropped partitions {', '.join(dropnames)} from {table} table")
+
+        while True:
+            res = self.__execute(f"DELETE FROM {table} WHERE log_time < NOW() - INTERVAL '{days}' DAY LIMIT {TRIM_CHUNKSIZE}")
+            if res is False:
+                return False
+            deleted += res
+            if res < TRIM_CHUNKSIZE:
+                break
+
+        return deleted
+
+
+    def partition_table(self, table):
+        """
+        Partition a table with log_time by day, and create partitions PARTITION_DAYSAHEAD days ahead
+        An unpartitioned table is converted once, with existing rows kept in partition pold
+        Every unique key of a partitioned table must include log_time, so id becomes PRIMARY KEY (id, log_time)
+
+        Parameters:
+            table (str): Table name, either analytics or dnslog
+        Returns:
+            True: Table is partitioned
+            False: Partitioning isn't available, trimming will use chunked DELETE
+        """
+        alterations = []
+        partitions = self.__get_partitions(table)
+        today = date.today()
+        lastday = today + timedelta(days=PARTITION_DAYSAHEAD)
+
+        if len(partitions) == 0:
+            print(f'Partitioning {table} table by day, this may take a while')
+            keys = set(row[2] for row in self.__search(f'SHOW INDEX FROM {table}'))
+            if 'PRIMARY' in keys:
+                alterations.append('DROP PRIMARY KEY')
+            if 'id' in keys:
+                alterations.append('DROP INDEX id')
+
+            res = self.__execute(f'DELETE FROM {table} WHERE log_time IS NULL')
+            if res:
+                print(f'Deleted {res} rows without log_time from {table} table')
+
+            res = self.__execute(f"ALTER TABLE {table} MODIFY log_time DATETIME NOT NULL, {', '.join(alterations + ['ADD PRIMARY KEY (id, log_time)'])} PARTITION BY RANGE (TO_DAYS(log_time)) (PARTITION pold VALUES LESS THAN ({today.toordinal() + TO_DAYS_OFFSET}), {self.__partition_definitions(today, lastday)})")
+            if res is False:
+                logger.warning(f'Unable to partition {table} table, trimming will use DELETE')
+                return False
+            return True
+
+        bounds = [bound for bound in partitions.values() if bound is not None]
+        if 'pfuture' not in partitions or len(bounds) == 0:
+            return True                                    #Not partitioned by NoTrack
+
+        firstday = date.fromordinal(max(bounds) - TO_DAYS_OFFSET) #Day after newest daily partition
+        if firstday <= lastday:
+            self.__execute(f'ALTER TABLE {table} REORGANIZE PARTITION pfuture INTO ({self.__partition_definitions(firstday, lastday)})')
+
+        return True
+
+
+    def rollup_createtable(self):
+        """
+        Create SQL tables for hourly and daily dnslog rollups, in case they have been deleted
+        A new rollup table is filled from the existing rows in dnslog
+        """
+        for table, period, periodtype, periodexpr in ROLLUPS:
+            if len(self.__search(f"SHOW TABLES LIKE '{table}'")) > 0:
+                continue
+
+            print(f'Creating SQL Table {table}')
+            self.__execute(f"CREATE TABLE {table} ({period} {periodtype} NOT NULL, sys VARCHAR(45) NOT NULL, dns_request VARCHAR(255) NOT NULL, severity CHAR(1) NOT NULL, bl_source VARCHAR(50) NOT NULL DEFAULT '', queries INT UNSIGNED NOT NULL, PRIMARY KEY ({period}, sys, dns_request, severity, bl_source))")
+
+            res = self.__execute(f"INSERT INTO {table} ({period}, sys, dns_request, severity, bl_source, queries) SELECT {periodexpr}, LEFT(sys, 45), LEFT(dns_request, 255), severity, IFNULL(bl_source, ''), COUNT(*) FROM dnslog GROUP BY 1, 2, 3, 4, 5")
+            if res != False:
+                print(f'Added {res} rows to {table} from dnslog table')
+
+
+    def rollup_trim(self, hourlydays, dailydays):
+        """
+        Trim rows older than a specified number of days from the rollup tables
+        Parameters:
+            hourlydays (int): Interval of days to keep in dnslog_hourly
+            dailydays (int): Interval of days to keep in dnslog_daily
+                        When days is set to zero nothing will be deleted
+        Returns:
+            Success: True
+            Failure: False
+        """
+        for (table, period, _, _), days in zip(ROLLUPS, (hourlydays, dailydays)):
+            if not isinstance(days, int):                  #Check Days is an integer value
+                logger.warning(f'Invalid number of days specified for {table}')
+                return False
+
+            if days == 0:
+                continue
+
+            res = self.__execute(f"DELETE FROM {table} WHERE {period} < NOW() - INTERVAL '{days}' DAY")
+            if res is False:
+                return False
+
+            print(f'Trimmed {res} rows from {table} table')
 
         return True
 
@@ -477,7 +1033,7 @@ class DBWrapper:
         Delete all rows from dnslog and weblog
         NOTE weblog will be deprecated soon
         """
-        cursor = DBWrapper.__db.cursor()
+        cursor = self.__db.cursor()
 
         print('Deleting contents of dnslog and weblog tables')
 
@@ -488,4 +1044,9 @@ class DBWrapper:
         cursor.execute('DELETE LOW_PRIORITY FROM weblog');
         print('Deleting %d rows from weblog ' % cursor.rowcount)
         cursor.execute('ALTER TABLE weblog AUTO_INCREMENT = 1');
-        DBWrapper.__db.commit()
+
+        for table, _, _, _ in ROLLUPS:
+            cursor.execute(f'DELETE LOW_PRIORITY FROM {table}');
+            print('Deleting %d rows from %s ' % (cursor.rowcount, table))
+        self.__execute('DELETE FROM analytics_state')     #dnslog ids start again from 1
+        self.__db.commit()
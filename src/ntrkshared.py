@@ -13,6 +13,7 @@ logger.setLevel(logging.INFO)
 
 #Constants
 VERSION = '20.10'
+CHUNK_SIZE = 65536                                         #Read / write size for streaming files
 
 def check_root():
     """
@@ -205,6 +206,42 @@ def load_file(filename):
     return filelines
 
 
+def read_lines(filename, buffersize=1048576, use_mmap=False):
+    """
+    Generator which reads a file line by line, rather than loading it into memory
+    1. Check file exists
+    2. Yield each line using a large read buffer, or from a memory map of the file
+
+    Parameters:
+        filename (str): File to read
+        buffersize (int): Read buffer size in bytes
+        use_mmap (bool): Read lines from a memory map of the file
+    Yields:
+        Each line in file, with CRLF line endings converted to LF the same as text mode
+        Nothing if file doesn't exist or error occured
+    """
+    import mmap
+
+    print(f'Loading {filename}')
+    if not os.path.isfile(filename):
+        print(f'Unable to load {filename}, file is missing', file=sys.stderr)
+        return
+
+    try:
+        if use_mmap and os.path.getsize(filename) > 0:     #Can't map an empty file
+            with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for line in iter(mm.readline, b''):
+                    if line.endswith(b'\r\n'):            #Windows line endings
+                        line = line[:-2] + b'\n'
+                    yield line.decode('utf-8', errors='replace')
+        else:
+            with open(filename, 'r', buffering=buffersize, errors='replace') as f:
+                yield from f
+    except OSError as e:
+        print(f'Unable to read {filename}', file=sys.stderr)
+        print(e, file=sys.stderr)
+
+
 def save_file(lines, filename):
     """
     Save a list into a file
@@ -231,18 +268,101 @@ def save_file(lines, filename):
     return True
 
 
-def download_file(url, destination):
+def save_file_atomic(lines, filename):
+    """
+    Save a list into a file atomically
+    Lines are written to a temporary file in the same folder, flushed to disk,
+    and then renamed over filename, so readers see either the old or new file
+
+    Parameters:
+        lines (list): lines of ascii data to save to file
+        filename (str): File to save to
+    Returns:
+        True on success
+        False on error
+    """
+    tempfile = f'{filename}.tmp'
+
+    try:
+        with open(tempfile, 'w') as f:                     #Open temp file for ascii writing
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tempfile, filename)
+
+        dirfd = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY)
+        try:                                               #Make sure rename is on disk
+            os.fsync(dirfd)
+        finally:
+            os.close(dirfd)
+    except OSError as e:
+        print(f'Unable to write to file {e}', file=sys.stderr)
+        delete(tempfile)
+        return False
+
+    return True
+
+
+def compare_file(lines, filename):
+    """
+    Compare a sorted list against the lines of an existing sorted file
+    The file is read line by line and merged with the list, so only one line of it is held at a time
+
+    Parameters:
+        lines (list): Sorted lines of ascii data
+        filename (str): Sorted file to compare against
+    Returns:
+        Tuple of number of lines added and removed
+        None when the file isn't sorted, e.g. it was written by an older version
+    """
+    added = 0
+    removed = 0
+    pos = 0                                                #Position in lines
+    previous = ''
+
+    if not os.path.isfile(filename):
+        return tuple([len(lines), 0])
+
+    for line in read_lines(filename):
+        if line < previous:                                #Unable to merge an unsorted file
+            return None
+        previous = line
+
+        while pos < len(lines) and lines[pos] < line:      #Lines missing from file
+            added += 1
+            pos += 1
+
+        if pos < len(lines) and lines[pos] == line:
+            pos += 1
+        else:                                              #Line missing from lines
+            removed += 1
+
+    added += len(lines) - pos
+
+    return tuple([added, removed])
+
+
+def download_file(url, destination, cacheinfo=None, decompress=''):
     """
     Download File
     1. Make 3 attempts at downloading a file using a different user-agent each time
     2. Some sites reject the default python/urllib agent, so we try wget first
     followed by Chrome on Windows 10, Firefox on Linux x64, then Chromium on Linux x64
-    3. Save File to destination
+    3. Optionally make a conditional request using ETag / Last-Modified from cacheinfo
+    4. Stream File to destination in chunks, optionally decompressing it on the fly
+
+    When cacheinfo is supplied it is updated with:
+        etag, lastmodified - Validators sent by the server
+        modified - False when the server responded 304 Not Modified
+        hash, size - SHA256 and size of the file written to destination
 
     Parameters:
-        URL, List Name, File Destination
+        url (str): URL
+        destination (str): File Destination
+        cacheinfo (dict): Optional validators from a previous download
+        decompress (str): Optional compression type - zip, gzip, or xz
     Returns:
-        True - Success
+        True - Success (including 304 Not Modified)
         False - Failed download
     """
     from urllib.request import Request, urlopen
@@ -258,14 +378,28 @@ def download_file(url, destination):
 
 
 
+    conditional = dict()                                   #Conditional request headers
+
+    #Only make a conditional request if there is an existing copy to fall back on
+    if cacheinfo is not None and os.path.isfile(destination):
+        if cacheinfo.get('etag', '') != '':
+            conditional['If-None-Match'] = cacheinfo['etag']
+        if cacheinfo.get('lastmodified', '') != '':
+            conditional['If-Modified-Since'] = cacheinfo['lastmodified']
+
     print('Downloading %s' % url)
 
     for i in range(1, 4):
-        req = Request(url, headers={'User-Agent': user_agents[i]})
+        req = Request(url, headers={'User-Agent': user_agents[i], **conditional})
         try:
             response = urlopen(req)
         except HTTPError as e:
-            if e.code >= 500 and e.code < 600:
+            if e.code == 304 and len(conditional) > 0:     #304 - Existing copy is still fresh
+                print('HTTP Response 304: Not modified')
+                os.utime(destination)                      #Reset file age
+                cacheinfo['modified'] = False
+                return True
+            elif e.code >= 500 and e.code < 600:
                 #Take another attempt up to max of for loop
                 print('HTTP Error %d: Server side error' % e.code)
             elif e.code == 400:
@@ -303,11 +437,241 @@ def download_file(url, destination):
 
         time.sleep(i * 2)                                  #Throttle repeat attemps
 
-    save_blob(response.read(), destination)                #Write file to destination
+    filehash = save_stream(response, destination, decompress) #Write file to destination
+
+    if filehash is None:
+        return False
+
+    if cacheinfo is not None:                              #Record validators for next time
+        cacheinfo['etag'] = response.headers.get('ETag', '')
+        cacheinfo['lastmodified'] = response.headers.get('Last-Modified', '')
+        cacheinfo['modified'] = True
+        cacheinfo['hash'], cacheinfo['size'] = filehash
 
     return True
 
 
+class StreamReader:
+    """
+    Buffered reader for a non-seekable stream, such as a HTTP response
+    Allows an exact number of bytes to be read and unused data to be pushed back
+    """
+    def __init__(self, stream):
+        self.__stream = stream
+        self.__buffer = b''
+
+
+    def read(self, size=-1):
+        """
+        Read up to size bytes, or the next chunk when size is not specified
+        Less than size bytes will only be returned at the end of the stream
+        """
+        data = b''
+
+        if size < 0:                                       #Next available chunk
+            if self.__buffer != b'':
+                data, self.__buffer = self.__buffer, b''
+                return data
+            return self.__stream.read(CHUNK_SIZE)
+
+        while len(self.__buffer) < size:
+            data = self.__stream.read(max(CHUNK_SIZE, size - len(self.__buffer)))
+            if not data:                                   #End of stream
+                break
+            self.__buffer += data
+
+        data, self.__buffer = self.__buffer[:size], self.__buffer[size:]
+        return data
+
+
+    def unread(self, data):
+        """
+        Push data back to be read again
+        """
+        self.__buffer = data + self.__buffer
+
+
+def decompress_stream(stream, decompress):
+    """
+    Generator which yields decompressed chunks from a stream
+    Multi member gzip and multi stream xz files are supported
+    For zip files only .txt files are extracted
+
+    Parameters:
+        stream (file like object): Stream to read from
+        decompress (str): Compression type - zip, gzip, xz, or blank for none
+    Yields:
+        Chunks of bytes
+    Raises:
+        ValueError: Compressed stream ended before the end of a member / stream
+    """
+    import lzma
+    import zlib
+
+    reader = StreamReader(stream)
+
+    if decompress == 'zip':
+        yield from unzip_stream(reader)
+        return
+
+    if decompress == 'gzip':
+        new_decompressor = lambda: zlib.decompressobj(zlib.MAX_WBITS | 32) #Auto detect gzip header
+    elif decompress == 'xz':
+        new_decompressor = lambda: lzma.LZMADecompressor()
+    else:                                                  #No compression
+        for chunk in iter(reader.read, b''):
+            yield chunk
+        return
+
+    decompressor = new_decompressor()
+    complete = 0                                           #Members / streams read to their end
+    started = False                                        #Has current member / stream been given data?
+
+    for chunk in iter(reader.read, b''):
+        while chunk:
+            if decompress == 'gzip' and complete > 0 and not started:
+                chunk = chunk.lstrip(b'\x00')              #Trailing zero padding after a member, as gzip module
+                if not chunk:
+                    break
+            yield decompressor.decompress(chunk)
+            started = True
+            chunk = b''
+            if decompressor.eof:                           #Start of next member / stream?
+                chunk = decompressor.unused_data
+                decompressor = new_decompressor()
+                complete += 1
+                started = False
+
+    if started or complete == 0:                           #Stream ended part way through
+        raise ValueError(f'{decompress} stream is truncated')
+
+
+def unzip_stream(reader):
+    """
+    Generator which extracts .txt files from a zip file as it is read
+    Zip files are read by their local file headers, meaning the central directory
+    at the end of the file (and seeking back to the start) isn't necessary
+
+    Parameters:
+        reader (StreamReader): Stream to read from
+    Yields:
+        Chunks of bytes from any .txt files
+    """
+    import struct
+    import zlib
+
+    while True:
+        header = reader.read(30)                           #Local file header
+        if len(header) < 30 or header[:4] != b'PK\x03\x04': #Reached central directory
+            return
+
+        flags, method = struct.unpack('<HH', header[6:10])
+        compressedsize = struct.unpack('<I', header[18:22])[0]
+        namelen, extralen = struct.unpack('<HH', header[26:30])
+
+        name = reader.read(namelen).decode('utf-8' if flags & 0x800 else 'cp437')
+        reader.read(extralen)
+        wanted = name.endswith('.txt')
+
+        if wanted:
+            print(f'Extracting {name}')
+
+        if method == 8:                                    #Deflate - decompressor knows the end
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            while not decompressor.eof:
+                chunk = reader.read()
+                if not chunk:
+                    raise ValueError(f'Zip file truncated in {name}')
+                chunk = decompressor.decompress(chunk)
+                if wanted:
+                    yield chunk
+            reader.unread(decompressor.unused_data)
+
+        elif method == 0 and not flags & 0x08:             #Stored with a known size
+            while compressedsize > 0:
+                chunk = reader.read(min(compressedsize, CHUNK_SIZE))
+                if not chunk:
+                    raise ValueError(f'Zip file truncated in {name}')
+                compressedsize -= len(chunk)
+                if wanted:
+                    yield chunk
+
+        else:
+            raise ValueError(f'Unsupported zip compression method {method} in {name}')
+
+        if flags & 0x08:                                   #Skip data descriptor (12 to 24 bytes)
+            descriptor = reader.read(24)
+            nextheader = len(descriptor)
+            for signature in (b'PK\x03\x04', b'PK\x01\x02'): #Next file or central directory
+                pos = descriptor.find(signature, 12)
+                if pos != -1 and pos < nextheader:
+                    nextheader = pos
+            reader.unread(descriptor[nextheader:])
+
+
+def save_stream(stream, filename, decompress=''):
+    """
+    Save a stream to a file in chunks, optionally decompressing it
+    Data is written to a temporary .part file, which replaces filename once complete
+    Peak memory use is independent of the size of the stream
+
+    Parameters:
+        stream (file like object): Stream to read from
+        filename (str): File to save to
+        decompress (str): Optional compression type - zip, gzip, or xz
+    Returns:
+        Tuple of SHA256 hex digest and size of the file written
+        None on error
+    """
+    from hashlib import sha256
+
+    filehash = sha256()
+    partfile = f'{filename}.part'
+    size = 0
+
+    try:
+        with open(partfile, 'wb') as f:                    #Open file for binary writing
+            for chunk in decompress_stream(stream, decompress):
+                if chunk:
+                    f.write(chunk)
+                    filehash.update(chunk)
+                    size += len(chunk)
+        os.replace(partfile, filename)
+    except Exception as e:                                 #Network, decompression, or OS errors
+        print('Error writing to %s' % filename)
+        print(e)
+        delete(partfile)
+        return None
+
+    return tuple([filehash.hexdigest(), size])
+
+
+def get_filehash(filename):
+    """
+    Get SHA256 hash and size of a file, reading it in chunks
+
+    Parameters:
+        filename (str): File to hash
+    Returns:
+        Tuple of hex digest and size in bytes
+        Empty string and zero if file is missing or unreadable
+    """
+    from hashlib import sha256
+
+    filehash = sha256()
+    size = 0
+
+    try:
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                filehash.update(chunk)
+                size += len(chunk)
+    except OSError:
+        return tuple(['', 0])
+
+    return tuple([filehash.hexdigest(), size])
+
+
 def unzip_multiple_files(sourcezip, destination):
     from zipfile import ZipFile
 
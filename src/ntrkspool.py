@@ -0,0 +1,195 @@
+#NoTrack Spool
+#Author: QuidsUp
+
+#Standard imports
+import logging
+import os
+import struct
+import threading
+import zlib
+
+#Local imports
+from ntrkshared import save_file_atomic
+
+#Create logger
+logger = logging.getLogger(__name__)
+
+#Constants
+RECORD_HEADER = struct.Struct('<II')                       #Length and CRC32 of record
+FIELD_SEPARATOR = '\x00'                                   #Separates fields of a row in a record
+
+class Spool:
+    """
+    Append-only file of rows waiting to be uploaded, which survives restarts
+    Each row is stored as a record of length, CRC32, and fields separated by a null byte
+    Rows are read from the committed offset, which is only moved forward once they have been uploaded
+    The spool is emptied once all rows have been committed
+    """
+    def __init__(self, filename):
+        """
+        Parameters:
+            filename (str): Spool file, the committed offset is kept in filename.offset
+        """
+        self.__filename = filename
+        self.__offsetfile = f'{filename}.offset'
+        self.__lock = threading.Lock()                     #Reader and writer may be on different threads
+
+        self.__offset = self.__load_offset()
+        self.__recover()
+
+
+    def __load_offset(self):
+        """
+        Load committed offset
+
+        Returns:
+            Committed offset, or zero when offset file is missing or invalid
+        """
+        try:
+            with open(self.__offsetfile, 'r') as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return 0
+
+
+    def __get_size(self):
+        """
+        Size of spool file, or zero when it doesn't exist
+        """
+        try:
+            return os.path.getsize(self.__filename)
+        except OSError:
+            return 0
+
+
+    def __read_records(self, f, maxrows, endpos):
+        """
+        Read records from the current position of an open spool file
+
+        Parameters:
+            f (file): Spool file opened for binary reading
+            maxrows (int): Maximum number of records to read
+            endpos (int): Stop at this position
+        Returns:
+            List of rows, and position after the last valid record
+        """
+        rows = []
+        pos = f.tell()
+
+        while len(rows) < maxrows and pos + RECORD_HEADER.size <= endpos:
+            length, crc = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+            if pos + RECORD_HEADER.size + length > endpos:  #Incomplete record
+                break
+
+            data = f.read(length)
+            if zlib.crc32(data) != crc:                    #Damaged record
+                break
+
+            rows.append(tuple(data.decode('utf-8').split(FIELD_SEPARATOR)))
+            pos += RECORD_HEADER.size + length
+
+        return rows, pos
+
+
+    def __recover(self):
+        """
+        Remove an incomplete or damaged record at the end of the spool, e.g. after a power cut
+        Otherwise new records would be appended after it and never be read
+        """
+        size = self.__get_size()
+
+        if self.__offset > size:                           #Spool was emptied before the offset was saved
+            self.__offset = 0
+            self.__save_offset()
+
+        if size == self.__offset:
+            return
+
+        validpos = self.__offset
+        with open(self.__filename, 'rb') as f:
+            f.seek(self.__offset)
+            while True:
+                rows, pos = self.__read_records(f, 10000, size)
+                if len(rows) == 0:
+                    break
+                validpos = pos
+                f.seek(pos)
+
+        if validpos != size:
+            logger.warning(f'Removing {size - validpos} damaged bytes from end of {self.__filename}')
+            os.truncate(self.__filename, validpos)
+
+
+    def __save_offset(self):
+        save_file_atomic([str(self.__offset)], self.__offsetfile)
+
+
+    def append(self, rows):
+        """
+        Add rows to the end of the spool, and flush them to disk
+
+        Parameters:
+            rows (iterable): Rows, each a sequence of strings which don't contain a null byte
+        Returns:
+            True on success
+            False on error
+        """
+        data = bytearray()
+
+        for row in rows:
+            record = FIELD_SEPARATOR.join(row).encode('utf-8')
+            data += RECORD_HEADER.pack(len(record), zlib.crc32(record))
+            data += record
+
+        with self.__lock:
+            try:
+                with open(self.__filename, 'ab') as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+            except OSError as e:
+                logger.error(f'Unable to write to {self.__filename}')
+                logger.error(e)
+                self.__recover()                           #Remove any partly written record
+                return False
+
+        return True
+
+
+    def commit(self, offset):
+        """
+        Mark rows before offset as uploaded
+        The spool is emptied when everything has been uploaded
+
+        Parameters:
+            offset (int): Position returned by read
+        """
+        with self.__lock:
+            self.__offset = offset
+
+            if self.__offset >= self.__get_size():         #All rows uploaded
+                #Empty spool before offset, a crash in between leaves the offset beyond the end
+                if os.path.isfile(self.__filename):
+                    os.truncate(self.__filename, 0)
+                self.__offset = 0
+
+            self.__save_offset()
+
+
+    def read(self, maxrows):
+        """
+        Read rows from the committed offset
+
+        Parameters:
+            maxrows (int): Maximum number of rows to read
+        Returns:
+            List of rows, and offset to commit once they have been uploaded
+        """
+        with self.__lock:
+            size = self.__get_size()
+            if size <= self.__offset:
+                return [], self.__offset
+
+            with open(self.__filename, 'rb') as f:
+                f.seek(self.__offset)
+                return self.__read_records(f, maxrows, size)
@@ -0,0 +1,92 @@
+#NoTrack Domain Suffix Index
+#Author: QuidsUp
+
+class SuffixIndex:
+    """
+    Hashed index of domains, which can be searched by any parent domain (suffix)
+    e.g. ads.site.co.uk is found under site.co.uk, co.uk, or uk
+    Each lookup is one hash probe per label, rather than a sort or a regex
+    Top Level Domains can be added with or without their leading dot (.uk or uk)
+    """
+    def __init__(self):
+        self.__index = dict()                              #Domain without leading dot: value
+
+
+    def __contains__(self, domain):
+        return domain.lstrip('.') in self.__index
+
+
+    def __len__(self):
+        return len(self.__index)
+
+
+    def add(self, domain, value=True):
+        """
+        Add domain to the index, replacing any existing value
+
+        Parameters:
+            domain (str): Domain or Top Level Domain
+            value: Value to return when domain or its subdomains are found
+        """
+        self.__index[domain.lstrip('.')] = value
+
+
+    def clear(self):
+        self.__index.clear()
+
+
+    def get(self, domain, default=None):
+        """
+        Get value for an exact domain
+        """
+        return self.__index.get(domain.lstrip('.'), default)
+
+
+    def items(self):
+        """
+        Iterate domains (without leading dot) and values in order they were added
+        """
+        return self.__index.items()
+
+
+    def find(self, domain, default=None):
+        """
+        Find the longest suffix of domain in the index, including domain itself
+
+        Parameters:
+            domain (str): Domain to search for
+            default: Value to return when nothing is found
+        Returns:
+            Value of the most specific matching domain
+        """
+        index = self.__index
+        pos = 0
+
+        while pos != -1:                                   #Read labels from left to right
+            if domain[pos:] in index:
+                return index[domain[pos:]]
+            pos = domain.find('.', pos) + 1 or -1
+
+        return default
+
+
+    def find_parent(self, domain, default=None):
+        """
+        Find the shortest suffix of domain in the index, excluding domain itself
+        i.e. is domain a subdomain of something in the index?
+
+        Parameters:
+            domain (str): Domain to search for
+            default: Value to return when nothing is found
+        Returns:
+            Value of the least specific matching parent domain
+        """
+        index = self.__index
+        pos = domain.rfind('.')
+
+        while pos > 0:                                     #Read labels from right to left
+            if domain[pos + 1:] in index:
+                return index[domain[pos + 1:]]
+            pos = domain.rfind('.', 0, pos)
+
+        return default